@@ -1,31 +1,288 @@
 #!/usr/bin/env python3
-import os, re, json, time, pathlib, itertools, requests, http.client, urllib.parse
+import io, os, re, json, time, queue, shutil, hashlib, tempfile, contextlib, argparse, pathlib, itertools, threading, http.client, urllib.parse
 from urllib.parse import quote_plus, urlsplit, urljoin
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple
+# requests, sqlite3 and the other heavier modules are imported where they are first used, so importing
+# this module (for Crawler, or just to parse arguments) stays cheap
 
-COOKIE_HEADER = os.environ["COOKIE_HEADER"]
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+COOKIE_HEADER = os.environ.get("COOKIE_HEADER")
+BASE_URL = os.environ.get("EXAMPAPERS_BASE_URL", "https://exampapers.ed.ac.uk").rstrip("/")
 REQUEST_TIMEOUT = 30
-PAUSE_BETWEEN_REQUESTS = 0.1
-MAX_DOWNLOAD_WORKERS = 5
+RATE_LIMIT_RPS = 10
+MAX_INFLIGHT_REQUESTS = 8
+MIN_DOWNLOAD_WORKERS = 2
+INITIAL_DOWNLOAD_WORKERS = 5
+MAX_DOWNLOAD_WORKERS = 16
+THROTTLE_RETRIES = 4
+THROTTLE_BACKOFF_SECONDS = 2
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF_SECONDS = 5
+MAX_RETRY_AFTER_SECONDS = 120
+PIPELINE_QUEUE_SIZE = 64
+ARCHIVE_SPOOL_BYTES = 4 * 1024 * 1024
+SEARCH_PAGE_SIZE = 100
+POOL_IDLE_SECONDS = 30
+CACHE_PATH = pathlib.Path(__file__).resolve().parent / ".metadata_cache.sqlite3"
+CACHE_TTL_SECONDS = 24 * 3600
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+INDEX_PATH = pathlib.Path(__file__).resolve().parent / ".paper_index.sqlite3"
+FAILURE_JOURNAL_PATH = pathlib.Path(__file__).resolve().parent / ".failed_downloads.json"
+
+item_uuid_re = re.compile(r'/server/api/core/items/([0-9a-f-]+)/bundles"')
+bundle_uuid_re = re.compile(r'/server/api/core/bundles/([0-9a-f-]+)/bitstreams')
+bit_uuid_re = re.compile(r'/core/bitstreams/([0-9a-f-]+)')
+
+class RateLimiter:
+    # token bucket (rate/sec, burst of `rate`) plus a cap on requests in flight
+    def __init__(self, rate=RATE_LIMIT_RPS, max_inflight=MAX_INFLIGHT_REQUESTS):
+        self.rate = float(rate)
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.max_inflight = max(1, int(max_inflight))
+        self.inflight = threading.BoundedSemaphore(self.max_inflight)
+
+    def _take_token(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.inflight.acquire()
+        try:
+            self._take_token()
+        except BaseException:
+            self.inflight.release()
+            raise
+        return self
 
-item_uuid_re = re.compile(r'https://exampapers\.ed\.ac\.uk/server/api/core/items/([0-9a-f-]+)/bundles"')
-bundle_uuid_re = re.compile(r'https://exampapers\.ed\.ac\.uk/server/api/core/bundles/([0-9a-f-]+)/bitstreams')
-bit_uuid_re = re.compile(r'https://exampapers\.ed\.ac\.uk/server/api/core/bitstreams/([0-9a-f-]+)/bundle')
-name_re = re.compile(r'"name"\s*:\s*"([^"]+)"')
+    def __exit__(self, *exc):
+        self.inflight.release()
+        return False
 
-def make_session():
+def make_session(cookie_header=None):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     s = requests.Session()
-    s.headers.update({"Cookie": COOKIE_HEADER, "Accept": "application/json, text/plain, */*", "User-Agent": "exam-scraper/1.3"})
+    s.headers.update({"Cookie": cookie_header or COOKIE_HEADER, "Accept": "application/json, text/plain, */*", "User-Agent": "exam-scraper/1.3"})
     retries = Retry(total=5, connect=5, read=5, backoff_factor=0.5, status_forcelist=[429,500,502,503,504], allowed_methods=frozenset(["GET"]), raise_on_status=False)
-    s.mount("https://", HTTPAdapter(max_retries=retries))
-    s.mount("http://", HTTPAdapter(max_retries=retries))
+    pool = max(MAX_INFLIGHT_REQUESTS, MAX_DOWNLOAD_WORKERS)
+    s.mount("https://", HTTPAdapter(max_retries=retries, pool_connections=pool, pool_maxsize=pool))
+    s.mount("http://", HTTPAdapter(max_retries=retries, pool_connections=pool, pool_maxsize=pool))
     return s
 
-def fetch_text(session, url):
-    r = session.get(url, timeout=REQUEST_TIMEOUT)
+class MetadataCache:
+    # SQLite store of metadata responses keyed by URL. Entries younger than ttl are served without a
+    # request; older ones are revalidated with If-None-Match / If-Modified-Since. Least recently used
+    # rows are evicted once the stored bodies exceed max_bytes.
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS, max_bytes=CACHE_MAX_BYTES, offline=False):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.stats = {"fresh": 0, "revalidated": 0, "fetched": 0}
+        import sqlite3
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY, body TEXT NOT NULL, etag TEXT, last_modified TEXT,
+            fetched_at REAL NOT NULL, last_used REAL NOT NULL, size INTEGER NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def get(self, url):
+        with self.lock:
+            row = self.db.execute("SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?", (url,)).fetchone()
+            if row:
+                self.db.execute("UPDATE responses SET last_used = ? WHERE url = ?", (time.time(), url))
+                self.db.commit()
+        if not row:
+            return None
+        return {"body": row[0], "etag": row[1], "last_modified": row[2], "fetched_at": row[3]}
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def touch(self, url):
+        now = time.time()
+        with self.lock:
+            self.db.execute("UPDATE responses SET fetched_at = ?, last_used = ? WHERE url = ?", (now, now, url))
+            self.db.commit()
+
+    def put(self, url, body, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (url, body, etag, last_modified, now, now, len(body.encode("utf-8"))))
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self.db.execute("SELECT url, size FROM responses ORDER BY last_used").fetchall():
+            self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class Metrics:
+    # per-stage request instrumentation: latency histogram, status codes, retries, redirects, bytes and the
+    # span between a stage's first request start and last request end (for throughput)
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = {"count": 0, "latency_sum": 0.0, "buckets": [0] * (len(self.BUCKETS) + 1),
+                                  "statuses": {}, "retries": 0, "redirects": 0, "bytes": 0, "first_start": None, "last_end": None}
+        return self.stages[stage]
+
+    def observe(self, stage, start, status, nbytes=0, retries=0, redirects=0):
+        end = time.monotonic()
+        latency = end - start
+        i = next((i for i, b in enumerate(self.BUCKETS) if latency <= b), len(self.BUCKETS))
+        with self.lock:
+            st = self._stage(stage)
+            st["count"] += 1
+            st["latency_sum"] += latency
+            st["buckets"][i] += 1
+            st["statuses"][str(status)] = st["statuses"].get(str(status), 0) + 1
+            st["retries"] += retries
+            st["redirects"] += redirects
+            st["bytes"] += nbytes
+            st["first_start"] = start if st["first_start"] is None else min(st["first_start"], start)
+            st["last_end"] = end if st["last_end"] is None else max(st["last_end"], end)
+
+    def retried(self, stage, n=1):
+        # retries decided outside the HTTP layer: throttled downloads and the pipeline's retry rounds
+        with self.lock:
+            self._stage(stage)["retries"] += n
+
+    def snapshot(self):
+        out = {}
+        with self.lock:
+            for stage, st in self.stages.items():
+                span = (st["last_end"] - st["first_start"]) if st["count"] else 0.0
+                cumulative, buckets = 0, {}
+                for bound, n in zip([*self.BUCKETS, "+Inf"], st["buckets"]):
+                    cumulative += n
+                    buckets[str(bound)] = cumulative
+                out[stage] = {"requests": st["count"], "latency_sum_s": round(st["latency_sum"], 6),
+                              "latency_mean_s": round(st["latency_sum"] / st["count"], 6) if st["count"] else None,
+                              "latency_buckets": buckets, "statuses": dict(st["statuses"]), "retries": st["retries"],
+                              "redirects": st["redirects"], "bytes": st["bytes"], "span_s": round(span, 6),
+                              "bytes_per_s": round(st["bytes"] / span, 1) if span > 0 else None,
+                              "requests_per_s": round(st["count"] / span, 2) if span > 0 else None}
+        return out
+
+    def prometheus(self, extra=(), help_texts=None):
+        # Prometheus text exposition; extra is an iterable of (name, labels dict, value), grouped by name
+        # with HELP (from help_texts) and TYPE lines: counter for names ending in _total, gauge otherwise
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def fmt(labels):
+            return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}" if labels else ""
+        snap = self.snapshot()
+        lines = ["# HELP exampapers_request_duration_seconds Request latency by pipeline stage.",
+                 "# TYPE exampapers_request_duration_seconds histogram"]
+        for stage, st in snap.items():
+            for bound, n in st["latency_buckets"].items():
+                lines.append(f"exampapers_request_duration_seconds_bucket{fmt({'stage': stage, 'le': bound})} {n}")
+            lines.append(f"exampapers_request_duration_seconds_sum{fmt({'stage': stage})} {st['latency_sum_s']}")
+            lines.append(f"exampapers_request_duration_seconds_count{fmt({'stage': stage})} {st['requests']}")
+        lines += ["# HELP exampapers_requests_total Requests by pipeline stage and final status.",
+                  "# TYPE exampapers_requests_total counter"]
+        for stage, st in snap.items():
+            for status, n in st["statuses"].items():
+                lines.append(f"exampapers_requests_total{fmt({'stage': stage, 'status': status})} {n}")
+        for name, key, help_text in (("retries", "retries", "Retries: by the HTTP retry policy, after throttling and in download retry rounds."),
+                                     ("redirects", "redirects", "Redirects followed."),
+                                     ("bytes", "bytes", "Response bytes received.")):
+            lines += [f"# HELP exampapers_{name}_total {help_text}", f"# TYPE exampapers_{name}_total counter"]
+            lines += [f"exampapers_{name}_total{fmt({'stage': stage})} {st[key]}" for stage, st in snap.items()]
+        lines += ["# HELP exampapers_stage_throughput_bytes_per_second Bytes per second over each stage's active span.",
+                  "# TYPE exampapers_stage_throughput_bytes_per_second gauge"]
+        lines += [f"exampapers_stage_throughput_bytes_per_second{fmt({'stage': stage})} {st['bytes_per_s'] or 0}" for stage, st in snap.items()]
+        grouped = {}
+        for name, labels, value in extra:
+            grouped.setdefault(name, []).append(f"exampapers_{name}{fmt(labels)} {value}")
+        for name, samples in grouped.items():
+            help_text = (help_texts or {}).get(name, name.replace("_", " ").capitalize() + ".")
+            lines += [f"# HELP exampapers_{name} {help_text}", f"# TYPE exampapers_{name} {'counter' if name.endswith('_total') else 'gauge'}"]
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+run_metrics = Metrics()
+
+def fetch_text(session, url, limiter=None, cache=None, stage="metadata", metrics=None):
+    metrics = metrics or run_metrics
+    entry = cache.get(url) if cache else None
+    if cache and cache.offline:
+        if entry is None:
+            raise RuntimeError(f"Not in metadata cache (offline): {url}")
+        cache.count("fresh")
+        return entry["body"]
+    if entry and cache.is_fresh(entry):
+        cache.count("fresh")
+        return entry["body"]
+
+    headers = {}
+    if entry:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    start = time.monotonic()
+    try:
+        if limiter is None:
+            r = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        else:
+            with limiter:
+                start = time.monotonic()
+                r = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    except Exception as e:
+        metrics.observe(stage, start, type(e).__name__)
+        raise
+    retries = getattr(getattr(r.raw, "retries", None), "history", None) or ()
+    metrics.observe(stage, start, r.status_code, len(r.content), len(retries))
+    if entry and r.status_code == 304:
+        cache.touch(url)
+        cache.count("revalidated")
+        return entry["body"]
     r.raise_for_status()
+    if cache:
+        cache.put(url, r.text, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+        cache.count("fetched")
     return r.text
 
 def sanitize_filename(name):
@@ -37,38 +294,274 @@ def sanitize_filename(name):
 def ensure_dir(p):
     pathlib.Path(p).mkdir(parents=True, exist_ok=True)
 
-def download_with_cookie_only(url, out_path, cookie_header, max_redirects=5, timeout=60):
-    redirects = 0
+class ConnectionPool:
+    # keep-alive http.client connections per (scheme, host, port), shared by the download workers.
+    # Also remembers redirects so later requests go straight to the final location.
+    def __init__(self, max_per_host=MAX_DOWNLOAD_WORKERS, idle_timeout=POOL_IDLE_SECONDS, cache_redirects=True):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.cache_redirects = cache_redirects
+        self.idle = {}
+        self.redirects = {}
+        self.origin_redirects = {}
+        self.lock = threading.Lock()
+        self.stats = {"connections_opened": 0, "tls_handshakes": 0, "connections_reused": 0, "redirects_followed": 0, "redirects_skipped": 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def acquire(self, scheme, host, port, timeout):
+        key = (scheme, host, port)
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self.lock:
+            conns = self.idle.get(key) or []
+            while conns:
+                c, last_used = conns.pop()
+                if now - last_used <= self.idle_timeout:
+                    conn = c
+                    break
+                stale.append(c)
+        for c in stale:
+            c.close()
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            self.count("connections_reused")
+            return conn, True
+        conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        conn = conn_cls(host, port, timeout=timeout)
+        self.count("connections_opened")
+        if scheme == "https":
+            self.count("tls_handshakes")
+        return conn, False
+
+    def release(self, key, conn):
+        self.evict_idle()
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_per_host:
+                conns.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for key, conns in self.idle.items():
+                expired.extend(c for c, last_used in conns if now - last_used > self.idle_timeout)
+                conns[:] = [(c, t) for c, t in conns if now - t <= self.idle_timeout]
+        for c in expired:
+            c.close()
+
+    def close(self):
+        with self.lock:
+            conns = [c for cs in self.idle.values() for c, _ in cs]
+            self.idle.clear()
+        for c in conns:
+            c.close()
+
+    def resolve(self, url):
+        if not self.cache_redirects:
+            return url
+        with self.lock:
+            if url in self.redirects:
+                self.stats["redirects_skipped"] += 1
+                return self.redirects[url]
+            parts = urlsplit(url)
+            origin = self.origin_redirects.get((parts.scheme, parts.netloc))
+            if origin:
+                self.stats["redirects_skipped"] += 1
+                return parts._replace(scheme=origin[0], netloc=origin[1]).geturl()
+        return url
+
+    def remember_redirect(self, url, target):
+        if not self.cache_redirects:
+            return
+        src, dst = urlsplit(url), urlsplit(target)
+        with self.lock:
+            self.redirects[url] = target
+            # scheme/host-only redirects (e.g. http -> https) apply to every path on that origin
+            if (src.path, src.query) == (dst.path, dst.query) and (src.scheme, src.netloc) != (dst.scheme, dst.netloc):
+                self.origin_redirects[(src.scheme, src.netloc)] = (dst.scheme, dst.netloc)
+
+download_pool = ConnectionPool()
+
+def _file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            md5.update(chunk)
+    return md5
+
+class Throttled(RuntimeError):
+    # the server answered 429/503; retry_after is its Retry-After in seconds, if it sent one
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status} (throttled)")
+        self.status = status
+        self.retry_after = retry_after
+
+class DownloadHTTPError(RuntimeError):
+    # the server answered a bitstream request with an error status (or bounced it to the login page)
+    def __init__(self, status, reason=""):
+        super().__init__(f"HTTP {status} {reason}".strip())
+        self.status = status
+
+def classify_download_error(exc):
+    # "auth" (the session expired; retrying with the same cookie cannot help), "permanent" (the bitstream
+    # is gone) or "transient" (timeouts, resets, 5xx, throttling, short or corrupt bodies)
+    status = getattr(exc, "status", None)
+    if status in (401, 403):
+        return "auth"
+    if status in (404, 410):
+        return "permanent"
+    return "transient"
+
+def parse_retry_after(value):
+    # Retry-After is either delay-seconds or an HTTP-date
+    import email.utils
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def download_with_cookie_only(url, out_path, cookie_header, max_redirects=5, timeout=60, pool=None, expected_size=None, expected_md5=None, metrics=None, trace=None, sink=None):
+    # streams into out_path + ".part", resuming an earlier partial file with a Range request (left by an earlier
+    # attempt at the same path: a retry round, a --sync folder or --retry-failed; a plain run's timestamped
+    # folder is always new), and only
+    # renames it into place once the size (and MD5, when known) match the bitstream metadata. Raises
+    # Throttled on 429/503. trace, if given, is filled with status, bytes, redirects and ttfb_s. With sink (a
+    # writable binary file object) the body is written there instead and out_path is not touched.
+    metrics = metrics or run_metrics
+    trace = trace if trace is not None else {}
+    trace.update(status=None, bytes=0, redirects=0, ttfb_s=None)
+    start = time.monotonic()
+    try:
+        result = _download(url, out_path, cookie_header, max_redirects, timeout, pool or download_pool, expected_size, expected_md5, trace, start, sink)
+    except Exception as e:
+        metrics.observe("downloads", start, trace["status"] or type(e).__name__, trace["bytes"], redirects=trace["redirects"])
+        raise
+    metrics.observe("downloads", start, trace["status"], trace["bytes"], redirects=trace["redirects"])
+    return result
+
+def _download(url, out_path, cookie_header, max_redirects, timeout, pool, expected_size, expected_md5, trace, start, sink=None):
+    part_path = f"{out_path}.part"
+    original_url = url
+    url = pool.resolve(url)
+    redirects = restarts = 0
     while True:
         parts = urlsplit(url)
-        conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
         port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
         path = parts.path + (("?" + parts.query) if parts.query else "")
-        conn = conn_cls(parts.hostname, port, timeout=timeout)
+        offset = os.path.getsize(part_path) if sink is None and os.path.exists(part_path) else 0
+        headers = {"Cookie": cookie_header}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        conn, reused = pool.acquire(parts.scheme, parts.hostname, port, timeout)
+        keep = False
         try:
-            conn.request("GET", path, headers={"Cookie": cookie_header})
-            resp = conn.getresponse()
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # the server closed an idle keep-alive connection; retry once on a fresh one
+                conn.close()
+                conn, reused = pool.acquire(parts.scheme, parts.hostname, port, timeout)
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+            trace["status"] = resp.status
+            trace["ttfb_s"] = time.monotonic() - start
+            if resp.status in (429, 503):
+                resp.read()
+                keep = not resp.will_close
+                raise Throttled(resp.status, parse_retry_after(resp.getheader("Retry-After")))
             if resp.status in (301, 302, 303, 307, 308):
+                resp.read()
+                keep = not resp.will_close
                 if redirects >= max_redirects:
                     raise RuntimeError("Too many redirects.")
                 location = resp.getheader("Location")
                 if not location:
                     raise RuntimeError("Redirect without Location header.")
-                url = urljoin(url, location)
+                target = urljoin(url, location)
+                if "/Shibboleth.sso/Login" in target:
+                    raise DownloadHTTPError(401, "redirected to login")
+                pool.count("redirects_followed")
+                pool.remember_redirect(url, target)
+                if url != original_url:
+                    pool.remember_redirect(original_url, target)
+                url = target
                 redirects += 1
-                conn.close()
+                trace["redirects"] += 1
                 continue
-            if resp.status != 200:
-                raise RuntimeError(f"HTTP {resp.status} {resp.reason}")
-            with open(out_path, "wb") as f:
-                while True:
-                    chunk = resp.read(65536)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-            return
+            if resp.status == 416 and offset:
+                resp.read()
+                keep = not resp.will_close
+                if offset != expected_size:
+                    # the .part file does not line up with what the server has; start over, once
+                    if restarts:
+                        raise DownloadHTTPError(resp.status, "range not satisfiable after restarting")
+                    restarts += 1
+                    os.remove(part_path)
+                    continue
+                md5, size = _file_md5(part_path), offset
+            else:
+                if resp.status == 206 and not (offset and (resp.getheader("Content-Range") or "").startswith(f"bytes {offset}-")):
+                    # a range we did not ask for; drop it and fetch the whole file, once
+                    resp.read()
+                    keep = not resp.will_close
+                    if restarts:
+                        raise DownloadHTTPError(resp.status, "unexpected partial content")
+                    restarts += 1
+                    if sink is None and os.path.exists(part_path):
+                        os.remove(part_path)
+                    continue
+                if resp.status == 206:
+                    md5, size, mode = _file_md5(part_path), offset, "ab"
+                elif resp.status == 200:
+                    md5, size, mode = hashlib.md5(), 0, "wb"
+                else:
+                    resp.read()
+                    keep = not resp.will_close
+                    raise DownloadHTTPError(resp.status, resp.reason)
+                with (contextlib.nullcontext(sink) if sink is not None else open(part_path, mode)) as f:
+                    while True:
+                        chunk = resp.read(65536)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        md5.update(chunk)
+                        size += len(chunk)
+                        trace["bytes"] += len(chunk)
+                keep = not resp.will_close
+            if expected_size is not None and size != expected_size:
+                # keep the .part so the next attempt can resume from here
+                raise RuntimeError(f"Incomplete download: {size} of {expected_size} bytes.")
+            if expected_md5 and md5.hexdigest() != expected_md5.lower():
+                if sink is None:
+                    os.remove(part_path)
+                raise RuntimeError("Checksum mismatch.")
+            if sink is None:
+                os.replace(part_path, out_path)
+            return size, md5.hexdigest()
         finally:
-            conn.close()
+            if keep:
+                pool.release(key, conn)
+            else:
+                conn.close()
 
 def dedupe(seq):
     seen, out = set(), []
@@ -77,167 +570,1590 @@ def dedupe(seq):
             seen.add(x); out.append(x)
     return out
 
-def progress(step_label, done, total):
-    pct = int(done * 100 / total) if total else 100
-    print(f"\r{step_label}: {pct}% completed", end="", flush=True)
+PIPELINE_STAGES = ("Search", "Items", "Bundles", "Downloads")
 
-def main():
-    print("Enter Course ID (e.g., MATH08058): ", end="", flush=True)
-    course_id = input().strip()
-    if not course_id:
-        print("No Course ID provided."); return
-    query = quote_plus(course_id)
-    initial_url = f"https://exampapers.ed.ac.uk/server/api/discover/search/objects?sort=dc.date.accessioned,DESC&page=0&size=9999&query={query}&embed=thumbnail&embed=item%2Fthumbnail"
+class StageProgress:
+    # live done/total counters per pipeline stage, redrawn on a single terminal line; also keeps when
+    # each stage first got work and last finished some, for wall time per stage. callback(stage, done, total)
+    # is called on every change, from whichever worker thread made it.
+    def __init__(self, stages=PIPELINE_STAGES, quiet=False, callback=None):
+        self.stages = list(stages)
+        self.done = dict.fromkeys(self.stages, 0)
+        self.total = dict.fromkeys(self.stages, 0)
+        self.first = {}
+        self.last = {}
+        self.quiet = quiet
+        self.callback = callback
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.lock = threading.Lock()
 
-    session = make_session()
+    def add(self, stage, n=1):
+        with self.lock:
+            self.total[stage] += n
+            self.first.setdefault(stage, time.monotonic())
+            self._render(stage)
 
-    base_dir = pathlib.Path(__file__).resolve().parent
-    stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-    folder_name = f"{sanitize_filename(course_id)}_{stamp}"
-    download_dir = base_dir / folder_name
-    ensure_dir(download_dir)
+    def step(self, stage, n=1):
+        with self.lock:
+            self.done[stage] += n
+            self.last[stage] = time.monotonic()
+            self._render(stage)
 
-    initial_text = fetch_text(session, initial_url)
-    time.sleep(PAUSE_BETWEEN_REQUESTS)
+    def add_bytes(self, n):
+        # bytes planned for download; negative when a planned download fails
+        with self.lock:
+            self.bytes_total += n
 
-    item_uuids = dedupe(item_uuid_re.findall(initial_text))
+    def step_bytes(self, n):
+        with self.lock:
+            self.bytes_done += n
+            self._render("Downloads")
 
-    # step 1: process item UUIDs -> fetch bundles
-    bundles_by_item = {}
-    skipped_bundles_no_original = 0
-    step1_total = len(item_uuids)
-    step1_done = 0
-    print()
-    for item_uuid in item_uuids:
-        url = f"https://exampapers.ed.ac.uk/server/api/core/items/{item_uuid}/bundles"
-        text = fetch_text(session, url)
-        time.sleep(PAUSE_BETWEEN_REQUESTS)
-        bundle_uuids = dedupe(bundle_uuid_re.findall(text))
-        bundles_by_item[item_uuid] = bundle_uuids
-        step1_done += 1
-        progress("Step 1/4", step1_done, step1_total)
-    print()
+    def eta(self):
+        # seconds left for the planned bytes at the download throughput so far, or None before the first finishes
+        start = self.first.get("Downloads")
+        if not self.bytes_done or start is None or time.monotonic() <= start:
+            return None
+        rate = self.bytes_done / (time.monotonic() - start)
+        return max(0, self.bytes_total - self.bytes_done) / rate
 
-    all_bundles = [(item_uuid, b) for item_uuid, bs in bundles_by_item.items() for b in bs]
-
-    # step 2: fetch bitstreams JSON for each bundle (UUID2)
-    bundle_texts = {}
-    step2_total = len(all_bundles)
-    step2_done = 0
-    for _, bundle_uuid in all_bundles:
-        url = f"https://exampapers.ed.ac.uk/server/api/core/bundles/{bundle_uuid}/bitstreams"
-        text = fetch_text(session, url)
-        time.sleep(PAUSE_BETWEEN_REQUESTS)
-        bundle_texts[bundle_uuid] = text
-        step2_done += 1
-        progress("Step 2/4", step2_done, step2_total)
-    print()
+    def wall_time(self, stage):
+        if stage not in self.first or stage not in self.last:
+            return 0.0
+        return self.last[stage] - self.first[stage]
+
+    def _render(self, stage):
+        if self.callback:
+            self.callback(stage, self.done[stage], self.total[stage])
+        if self.quiet:
+            return
+        line = " | ".join(f"{s} {self.done[s]}/{self.total[s]}" for s in self.stages)
+        if self.bytes_total:
+            line += f" | {self.bytes_done / 1e6:.1f}/{self.bytes_total / 1e6:.1f} MB"
+            eta = self.eta()
+            if eta is not None:
+                line += f" ETA {int(eta) // 60}:{int(eta) % 60:02d}"
+        print(f"\r{line}\033[K", end="", flush=True)
+
+class Bitstream(NamedTuple):
+    uuid: str
+    name: str
+    size_bytes: int | None
+    checksum: str | None
+    checksum_algorithm: str | None
+    bundle_name: str | None
+
+    @property
+    def md5(self):
+        return self.checksum if (self.checksum_algorithm or "").upper() == "MD5" else None
+
+class PaperResult(NamedTuple):
+    # what happened to one paper: "downloaded", "linked" (same bytes as a paper already on disk, hard-linked),
+    # "failed", "unchanged" (already current under --sync), "listed" (found but not downloaded, e.g. offline),
+    # "planned" (would be downloaded; dry run) or "skipped" (over the max_bytes budget). uuid is the
+    # bitstream's, item_uuid the item it was listed under.
+    course_id: str
+    uuid: str
+    name: str
+    path: str
+    size_bytes: int | None
+    md5: str | None
+    status: str
+    item_uuid: str | None = None
 
-    # step 3: extract UUID3 + names; skip bundles without ORIGINAL
-    bitstreams_by_bundle = {}
-    step3_total = len(all_bundles)
-    step3_done = 0
-    for _, bundle_uuid in all_bundles:
-        text = bundle_texts[bundle_uuid]
-
-        if "ORIGINAL" not in text:
-            skipped_bundles_no_original += 1
-            bitstreams_by_bundle[bundle_uuid] = []
-            step3_done += 1
-            progress("Step 3/4", step3_done, step3_total)
+def parse_bitstreams(listing):
+    # Bitstream records from a /bundles/{uuid}/bitstreams listing (raw text or decoded JSON) in one walk
+    # over _embedded.bitstreams; None if the bundle is not ORIGINAL
+    if isinstance(listing, (str, bytes)):
+        # an ORIGINAL bundle names itself somewhere in the body; skip decoding anything else
+        if ("ORIGINAL" if isinstance(listing, str) else b"ORIGINAL") not in listing:
+            return None
+        try:
+            data = json_loads(listing)
+        except ValueError:
+            return None
+    else:
+        data = listing
+    if not isinstance(data, dict):
+        return None
+    embedded = data.get("_embedded") or data.get("embedded") or {}
+    bundle_name = data.get("name")
+    records, seen = [], set()
+    for bs in embedded.get("bitstreams") or []:
+        links = bs.get("_links") or {}
+        u3 = bs.get("uuid") or bs.get("id")
+        if not u3:
+            m = bit_uuid_re.search(((links.get("self") or links.get("bundle") or {}).get("href")) or "")
+            u3 = m.group(1) if m else None
+        if not u3 or u3 in seen:
             continue
+        seen.add(u3)
+        checksum = bs.get("checkSum") or {}
+        records.append(Bitstream(u3, bs.get("name") or f"bitstream_{u3}.pdf", bs.get("sizeBytes"),
+                                 checksum.get("value"), checksum.get("checkSumAlgorithm"), bs.get("bundleName") or bundle_name))
+    if bundle_name is None and not any(r.bundle_name for r in records):
+        # nothing says which bundle this is; the body mentioned ORIGINAL (or it was decoded upstream)
+        original = True
+    else:
+        original = bundle_name == "ORIGINAL" or any(r.bundle_name == "ORIGINAL" for r in records)
+    return records if original else None
 
-        uuid3s = dedupe(bit_uuid_re.findall(text))
-        names = name_re.findall(text)
-        pairs = []
-        if uuid3s and names:
-            if len(uuid3s) == len(names):
-                pairs = list(zip(uuid3s, names))
-            else:
+class SyncManifest:
+    # .manifest.json in a stable per-course folder: bitstream uuid -> path, size and checksum of the
+    # local copy, so later runs only fetch new or changed bitstreams
+    FILE_NAME = ".manifest.json"
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.path = self.directory / self.FILE_NAME
+        self.lock = threading.Lock()
+        self.seen = set()
+        try:
+            self.entries = json.loads(self.path.read_text(encoding="utf-8")).get("bitstreams", {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def names(self):
+        return {e["path"] for e in self.entries.values()}
+
+    def path_for(self, uuid):
+        with self.lock:
+            self.seen.add(uuid)
+            entry = self.entries.get(uuid)
+        return self.directory / entry["path"] if entry else None
+
+    def is_current(self, uuid, size=None, checksum=None):
+        with self.lock:
+            self.seen.add(uuid)
+            entry = self.entries.get(uuid)
+        if not entry:
+            return False
+        if size is not None and entry["size"] != size:
+            return False
+        if checksum and entry.get("checksum") and entry["checksum"] != checksum:
+            return False
+        try:
+            return os.path.getsize(self.directory / entry["path"]) == entry["size"]
+        except OSError:
+            return False
+
+    def record(self, uuid, path, size, checksum):
+        with self.lock:
+            self.entries[uuid] = {"path": pathlib.Path(path).name, "size": size, "checksum": checksum}
+
+    def prune(self):
+        # drop (and delete) bitstreams that were not listed upstream on this run
+        removed = 0
+        with self.lock:
+            for uuid in [u for u in self.entries if u not in self.seen]:
                 try:
-                    data = json.loads(text)
-                    embedded = data.get("_embedded", {}) or data.get("embedded", {})
-                    bs_list = embedded.get("bitstreams") or []
-                    temp_pairs = []
-                    for bs in bs_list:
-                        href = ((((bs.get("_links") or {}).get("self") or {}).get("href")) or "")
-                        m = bit_uuid_re.search(href)
-                        u3 = m.group(1) if m else (bs.get("uuid") or "")
-                        nm = bs.get("name") or ""
-                        if u3 and nm:
-                            temp_pairs.append((u3, nm))
-                    pairs = temp_pairs if temp_pairs else [(u3, nm) for u3, nm in itertools.zip_longest(uuid3s, names, fillvalue="unknown")]
-                except Exception:
-                    pairs = [(u3, nm) for u3, nm in itertools.zip_longest(uuid3s, names, fillvalue="unknown")]
-        elif uuid3s:
-            pairs = [(u3, f"bitstream_{u3}.pdf") for u3 in uuid3s]
-
-        # dedupe pairs
-        seen_pairs, unique_pairs = set(), []
-        for p in pairs:
-            if p not in seen_pairs:
-                seen_pairs.add(p); unique_pairs.append(p)
-        bitstreams_by_bundle[bundle_uuid] = unique_pairs
-
-        step3_done += 1
-        progress("Step 3/4", step3_done, step3_total)
-    print()
+                    os.remove(self.directory / self.entries[uuid]["path"])
+                except FileNotFoundError:
+                    pass
+                del self.entries[uuid]
+                removed += 1
+        return removed
 
-    # prepare download jobs
-    download_jobs = []
-    used_names = set()
-    for bundle_uuid, pairs in bitstreams_by_bundle.items():
-        for uuid3, raw_name in pairs:
-            if not uuid3:
-                continue
-            base_name = sanitize_filename(raw_name)
-            if not base_name.lower().endswith(".pdf"):
-                base_name = f"{base_name}.pdf"
-            final_name = base_name
-            i = 2
-            while final_name in used_names or os.path.exists(download_dir / final_name):
-                stem, ext = os.path.splitext(base_name)
-                final_name = f"{stem} ({i}){ext}"
-                i += 1
-            used_names.add(final_name)
-            out_path = download_dir / final_name
-            download_url = f"http://exampapers.ed.ac.uk/server/api/core/bitstreams/{uuid3}/content"
-            download_jobs.append((download_url, str(out_path)))
-
-    total_planned = len(download_jobs)
-
-    # step 4: download PDFs concurrently (default 5 workers)
-    step4_total = total_planned
-    step4_done = 0
-    downloaded_success = 0
-
-    def _task(job):
-        url, path = job
+    def save(self):
+        with self.lock:
+            data = json.dumps({"bitstreams": self.entries}, indent=1, sort_keys=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(data, encoding="utf-8")
+        os.replace(tmp, self.path)
+
+class FailureJournal:
+    # downloads that still failed after the retry rounds, keyed by course and bitstream uuid (a cross-listed
+    # paper has an entry per course), with everything needed to fetch them again (--retry-failed) without
+    # searching or reading metadata. Entries are dropped once the bitstream is downloaded, linked or found
+    # unchanged.
+    JOB_FIELDS = ("uuid", "item", "name", "url", "path", "size", "checksum", "md5", "key")
+
+    def __init__(self, path=FAILURE_JOURNAL_PATH):
+        self.path = pathlib.Path(path)
+        self.lock = threading.Lock()
+        try:
+            self.entries = json.loads(self.path.read_text(encoding="utf-8")).get("failed", {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def record(self, run, job):
+        path = job["path"]
+        if not os.path.isabs(path):
+            # an --archive member name; a retry writes it into the course folder instead
+            path = str(run.download_dir / os.path.basename(path))
+        with self.lock:
+            self.entries[f"{run.course_id}/{job['uuid']}"] = {**{k: job.get(k) for k in self.JOB_FIELDS}, "path": path, "course_id": run.course_id,
+                                         "download_dir": str(run.download_dir), "sync": run.manifest is not None,
+                                         "error": job.get("error"), "message": job.get("message"), "attempts": job.get("attempts", 0) + 1,
+                                         "failed_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+    def resolve(self, course_id, uuid):
+        with self.lock:
+            self.entries.pop(f"{course_id}/{uuid}", None)
+            self.entries.pop(uuid, None)  # written before entries were keyed by course
+
+    def pending(self, course_ids=()):
+        with self.lock:
+            return [dict(e) for e in self.entries.values() if not course_ids or e["course_id"] in course_ids]
+
+    def save(self):
+        with self.lock:
+            if not self.entries:
+                data = None
+            else:
+                data = json.dumps({"failed": self.entries}, indent=1, sort_keys=True)
+        if data is None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        else:
+            write_text_atomic(self.path, data)
+
+class JobNamer:
+    # hands out unique .pdf paths in download_dir; safe to share between pipeline workers. The directory is
+    # listed once up front, so picking a free name never touches the filesystem. A name that is taken gets
+    # a suffix from the bitstream uuid rather than a counter, so it does not depend on which worker asked
+    # first.
+    def __init__(self, download_dir, reserved=()):
+        self.download_dir = pathlib.Path(download_dir)
+        self.used_names = set(reserved)
         try:
-            download_with_cookie_only(url, path, COOKIE_HEADER, timeout=REQUEST_TIMEOUT)
-            return True, job
+            self.used_names.update(e.name for e in os.scandir(self.download_dir))
+        except OSError:
+            pass
+        self.lock = threading.Lock()
+
+    def claim(self, raw_name, uuid=""):
+        base_name = sanitize_filename(raw_name)
+        if not base_name.lower().endswith(".pdf"):
+            base_name = f"{base_name}.pdf"
+        stem, ext = os.path.splitext(base_name)
+        tag = uuid.replace("-", "")
+        candidates = itertools.chain([base_name], (f"{stem} ({tag[:n]}){ext}" for n in (8, 12, 32) if len(tag) >= n),
+                                     (f"{stem} ({i}){ext}" for i in itertools.count(2)))
+        with self.lock:
+            final_name = next(name for name in candidates if name not in self.used_names)
+            self.used_names.add(final_name)
+        return self.download_dir / final_name
+
+def content_key(algorithm, checksum):
+    # "md5:<hex>" style key for the content store; None when the checksum is unknown
+    if not checksum:
+        return None
+    return f"{(algorithm or 'md5').lower()}:{checksum.lower()}"
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def link_or_copy(src, dst):
+    # puts a hard link to src at dst (a copy where links are not possible), replacing dst atomically
+    tmp = f"{dst}.part"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+class ContentStore:
+    # content-addressed index for one pipeline run: checksum key -> the local file that holds those bytes.
+    # The first bitstream with a given metadata checksum is downloaded and later ones wait for it and are
+    # hard-linked to it; files downloaded without a metadata checksum are keyed by the MD5 computed while
+    # streaming and replaced by a link when they turn out to be duplicates.
+    def __init__(self):
+        self.files = {}
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.stats = {"linked": 0, "linked_after_download": 0, "bytes_not_downloaded": 0, "bytes_not_stored": 0}
+
+    def seed(self, key, path):
+        with self.lock:
+            self.files.setdefault(key, str(path))
+
+    def claim(self, key, entry):
+        # ("stored", path) if the bytes are already on disk, ("waiting", None) if entry was queued behind a
+        # download in progress, ("download", None) if the caller should fetch them
+        with self.lock:
+            if key in self.files:
+                return "stored", self.files[key]
+            if key in self.waiting:
+                self.waiting[key].append(entry)
+                return "waiting", None
+            self.waiting[key] = []
+            return "download", None
+
+    def stored(self, key, path):
+        # the download for key finished; returns the entries that were waiting for it
+        with self.lock:
+            self.files[key] = str(path)
+            return self.waiting.pop(key, [])
+
+    def failed(self, key):
+        # the download for key failed; returns the next waiting entry, which becomes the one to download
+        with self.lock:
+            waiting = self.waiting.pop(key, [])
+            if not waiting:
+                return None
+            self.waiting[key] = waiting[1:]
+            return waiting[0]
+
+    def add_downloaded(self, key, path):
+        # registers a file hashed while streaming; returns the earlier file with the same bytes, if any
+        with self.lock:
+            earlier = self.files.get(key)
+            if earlier is None:
+                self.files[key] = str(path)
+            return earlier
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+class ArchiveWriter:
+    # one output archive (.zip, or an uncompressed .tar) instead of a file per paper. Download workers hand
+    # each verified paper over as a file object (see spool()) through a bounded queue and a single thread
+    # appends it, so papers are held in memory rather than staged on disk unless one is larger than
+    # ARCHIVE_SPOOL_BYTES. A duplicate becomes a hard-link member in tar; zip has no links, so there it is
+    # written again as a full member, copied from the archive itself. close() adds index.json as the last
+    # member and writes the same index to PATH.index.json; it records where each paper's bytes start, so
+    # read_archived_paper() can fetch one with a single seek.
+    INDEX_NAME = "index.json"
+
+    def __init__(self, path, queue_size=MAX_DOWNLOAD_WORKERS):
+        import tarfile, zipfile
+        self.path = pathlib.Path(path)
+        self.format = "zip" if self.path.suffix.lower() == ".zip" else "tar"
+        ensure_dir(self.path.parent)
+        if self.format == "zip":
+            self.archive = zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED, allowZip64=True)
+        else:
+            self.archive = tarfile.open(self.path, "w", format=tarfile.PAX_FORMAT)
+        self.index = {}
+        self.pending_links = {}
+        self.error = None
+        self.closed = False
+        self.q = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def spool():
+        # a download sink that stays in memory up to ARCHIVE_SPOOL_BYTES and spills to a temporary file
+        # beyond that, so in-flight and queued papers take at most about 2 * max downloads * that much RAM
+        return tempfile.SpooledTemporaryFile(ARCHIVE_SPOOL_BYTES)
+
+    def add(self, name, data, **meta):
+        # data is bytes or a file object positioned anywhere, which the writer closes
+        self.q.put(("file", name, data, meta))
+
+    def add_link(self, name, target, **meta):
+        self.q.put(("link", name, target, meta))
+
+    def _run(self):
+        while (entry := self.q.get()) is not _STOP:
+            try:
+                self._write(*entry)
+            except Exception as e:
+                self.error = self.error or e
+
+    def _write(self, kind, name, payload, meta):
+        import tarfile
+        if kind == "link":
+            target = self.index.get(payload)
+            if target is None:
+                # another worker found these bytes first but has not handed its copy over yet
+                self.pending_links.setdefault(payload, []).append((name, meta))
+                return
+            if self.format == "zip":
+                self.archive.fp.flush()
+                with open(self.path, "rb") as src:
+                    src.seek(target["offset"])
+                    offset = self._write_zip_member(name, src, target["size"])
+                self.index[name] = {**meta, "size": target["size"], "offset": offset, "same_as": payload}
+                return
+            info = tarfile.TarInfo(name)
+            info.type, info.linkname, info.mtime = tarfile.LNKTYPE, payload, time.time()
+            self.archive.addfile(info)
+            self.index[name] = {**meta, "size": target["size"], "offset": target["offset"], "same_as": payload}
+            return
+        src = io.BytesIO(payload) if isinstance(payload, bytes) else payload
+        with src:
+            size = src.seek(0, io.SEEK_END)
+            src.seek(0)
+            if self.format == "zip":
+                offset = self._write_zip_member(name, src, size)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size, info.mtime = size, time.time()
+                self.archive.addfile(info, src)
+                # the member's data is the last thing written, padded to whole 512-byte blocks
+                offset = self.archive.offset - -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        self.index[name] = {**meta, "size": size, "offset": offset}
+        for link_name, link_meta in self.pending_links.pop(name, ()):
+            self._write("link", link_name, name, link_meta)
+
+    def _write_zip_member(self, name, src, size):
+        # streams size bytes of src into a stored member; returns the offset of its data
+        import zipfile
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.file_size = size
+        with self.archive.open(info, "w") as dest:
+            remaining = size
+            while remaining:
+                chunk = src.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise EOFError(f"{name}: source ended {remaining} bytes early")
+                dest.write(chunk)
+                remaining -= len(chunk)
+        # stored data follows the 30-byte local header, whose last two fields are the name and extra lengths
+        fp = self.archive.fp
+        end = fp.tell()
+        fp.seek(info.header_offset + 26)
+        name_len, extra_len = int.from_bytes(fp.read(2), "little"), int.from_bytes(fp.read(2), "little")
+        fp.seek(end)
+        return info.header_offset + 30 + name_len + extra_len
+
+    def close(self):
+        # writes everything handed over so far plus the index; a second call does nothing
+        if self.closed:
+            return
+        self.closed = True
+        self.q.put(_STOP)
+        self.thread.join()
+        if self.pending_links:
+            self.error = self.error or RuntimeError(f"{sum(map(len, self.pending_links.values()))} duplicate(s) whose original was never written")
+        data = json.dumps({"format": self.format, "papers": self.index}, indent=1, sort_keys=True)
+        try:
+            self._write("file", self.INDEX_NAME, data.encode("utf-8"), {})
+        finally:
+            self.index.pop(self.INDEX_NAME, None)
+            self.archive.close()
+        write_text_atomic(f"{self.path}.index.json", data)
+        if self.error:
+            raise self.error
+
+def read_archived_paper(archive_path, name):
+    # bytes of one paper from an ArchiveWriter archive, found through its PATH.index.json without reading the rest
+    with open(f"{archive_path}.index.json", encoding="utf-8") as f:
+        entry = json.load(f)["papers"][name]
+    with open(archive_path, "rb") as f:
+        f.seek(entry["offset"])
+        return f.read(entry["size"])
+
+class AdaptiveConcurrency:
+    # AIMD limit on in-flight downloads. Every window of `limit` completed downloads, the limit goes up by
+    # one if throughput beat the previous window while time-to-first-byte stayed near the best seen, and
+    # down by one if time-to-first-byte grew well past it (relatively and by LATENCY_SLACK_S). A 429/503
+    # halves it (once per burst) and holds every download back until Retry-After has passed.
+    LATENCY_TOLERANCE = 2.0
+    LATENCY_SLACK_S = 0.05
+    THROUGHPUT_GAIN = 0.05
+
+    def __init__(self, min_limit=MIN_DOWNLOAD_WORKERS, max_limit=MAX_DOWNLOAD_WORKERS, initial=INITIAL_DOWNLOAD_WORKERS):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, initial))
+        self.inflight = 0
+        self.resume_at = 0.0
+        self.cond = threading.Condition()
+        self.started = self.last_decrease = time.monotonic()
+        self.best_ttfb = None
+        self.prev_throughput = 0.0
+        self._reset_window(self.started)
+        self.history = [(0.0, self.limit, "start")]
+        self.stats = {"increases": 0, "decreases": 0, "throttled": 0, "backoff_s": 0.0, "peak": self.limit}
+
+    def _reset_window(self, now):
+        self.window = {"start": now, "count": 0, "bytes": 0, "ttfb_s": 0.0}
+
+    def _set_limit(self, limit, now, reason):
+        limit = min(self.max_limit, max(self.min_limit, limit))
+        if limit == self.limit:
+            return
+        self.stats["increases" if limit > self.limit else "decreases"] += 1
+        self.stats["peak"] = max(self.stats["peak"], limit)
+        self.limit = limit
+        self.history.append((round(now - self.started, 3), limit, reason))
+
+    def acquire(self):
+        # blocks until a slot is free and any Retry-After pause is over; returns the start time for release()
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    self.cond.wait(self.resume_at - now)
+                elif self.inflight >= self.limit:
+                    self.cond.wait()
+                else:
+                    break
+            self.inflight += 1
+            return now
+
+    def release(self, started, nbytes=None, ttfb=None, throttled=False, retry_after=None):
+        # nbytes is None for a failed download, which says nothing about capacity
+        with self.cond:
+            now = time.monotonic()
+            self.inflight -= 1
+            if throttled:
+                self.stats["throttled"] += 1
+                delay = THROTTLE_BACKOFF_SECONDS if retry_after is None else min(retry_after, MAX_RETRY_AFTER_SECONDS)
+                if now + delay > self.resume_at:
+                    self.stats["backoff_s"] += now + delay - max(now, self.resume_at)
+                    self.resume_at = now + delay
+                if started >= self.last_decrease:
+                    # downloads already in flight at the last decrease do not halve it again
+                    self.last_decrease = now
+                    self._set_limit(self.limit // 2, now, "throttled")
+                    self.prev_throughput = 0.0
+                    self._reset_window(now)
+            elif nbytes is not None:
+                w = self.window
+                w["count"] += 1
+                w["bytes"] += nbytes
+                w["ttfb_s"] += ttfb or 0.0
+                if w["count"] >= self.limit and now > w["start"]:
+                    self._end_window(now)
+            self.cond.notify_all()
+
+    def _end_window(self, now):
+        w = self.window
+        throughput = w["bytes"] / (now - w["start"])
+        ttfb = w["ttfb_s"] / w["count"]
+        self.best_ttfb = ttfb if self.best_ttfb is None else min(self.best_ttfb, ttfb)
+        if ttfb > max(self.best_ttfb * self.LATENCY_TOLERANCE, self.best_ttfb + self.LATENCY_SLACK_S):
+            self._set_limit(self.limit - 1, now, "latency")
+        elif throughput > self.prev_throughput * (1 + self.THROUGHPUT_GAIN):
+            self._set_limit(self.limit + 1, now, "throughput")
+        self.prev_throughput = throughput
+        self._reset_window(now)
+
+    def report(self):
+        with self.cond:
+            return {"min": self.min_limit, "max": self.max_limit, "final": self.limit, **self.stats,
+                    "backoff_s": round(self.stats["backoff_s"], 3),
+                    "history": [{"t_s": t, "limit": limit, "reason": reason} for t, limit, reason in self.history]}
+
+def download_job(job, concurrency=None, cookie_header=None, sink=None):
+    # job: {"uuid", "item", "name", "url", "path", "size", "checksum", "md5"}; returns (size, md5) of the written file, or None.
+    # Throttled downloads are retried up to THROTTLE_RETRIES times after the Retry-After pause. With sink the
+    # body goes into that file object (emptied before each attempt) instead of job["path"]. On failure,
+    # job["error"] is set to classify_download_error's kind and job["message"] to the error.
+    concurrency = concurrency or AdaptiveConcurrency(1, 1, 1)
+    for attempt in range(THROTTLE_RETRIES + 1):
+        started = concurrency.acquire()
+        trace = {}
+        if sink is not None:
+            sink.seek(0)
+            sink.truncate()
+        try:
+            result = download_with_cookie_only(job["url"], job["path"], cookie_header or COOKIE_HEADER, timeout=REQUEST_TIMEOUT, expected_size=job["size"],
+                                               expected_md5=job["md5"], trace=trace, sink=sink)
+        except Throttled as e:
+            concurrency.release(started, throttled=True, retry_after=e.retry_after)
+            job["error"], job["message"] = "transient", str(e)
+            if attempt < THROTTLE_RETRIES:
+                run_metrics.retried("downloads")
+            continue
+        except Exception as e:
+            concurrency.release(started)
+            job["error"], job["message"] = classify_download_error(e), str(e)
+            return None
+        concurrency.release(started, trace["bytes"], trace["ttfb_s"])
+        return result
+    return None
+
+_STOP = object()
+
+class LargestFirstQueue(queue.PriorityQueue):
+    # download job queue that hands out the biggest known bitstream first (longest-processing-time-first),
+    # so a large scan found late does not end up as the run's last straggler. Entries are (run, job);
+    # jobs without a size go after sized ones and _STOP after everything.
+    def __init__(self):
+        super().__init__()
+        self.seq = itertools.count()
+
+    def _put(self, entry):
+        if entry is _STOP:
+            key = (2, 0)
+        else:
+            size = entry[1]["size"]
+            key = (0, -size) if size is not None else (1, 0)
+        super()._put((key, next(self.seq), entry))
+
+    def _get(self):
+        return super()._get()[2]
+
+def start_workers(count, in_q, handle):
+    def loop():
+        while True:
+            x = in_q.get()
+            if x is _STOP:
+                return
+            handle(x)
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(count)]
+    for t in threads:
+        t.start()
+    return threads
+
+def close_workers(in_q, threads):
+    for _ in threads:
+        in_q.put(_STOP)
+    for t in threads:
+        t.join()
+
+def search_url(course_id, page=0, size=SEARCH_PAGE_SIZE, embed=True):
+    query = quote_plus(course_id)
+    url = f"{BASE_URL}/server/api/discover/search/objects?sort=dc.date.accessioned,DESC&page={page}&size={size}&query={query}&embed=thumbnail&embed=item%2Fthumbnail"
+    return url + "&embed=bundles%2Fbitstreams" if embed else url
+
+def item_bundles_url(item_uuid, embed=True):
+    url = f"{BASE_URL}/server/api/core/items/{item_uuid}/bundles"
+    return url + "?embed=bitstreams" if embed else url
+
+def fetch_embed_text(session, url, plain_url, limiter, cache, stage):
+    # servers that reject the embed parameter get the plain per-object request instead
+    import requests
+    try:
+        return fetch_text(session, url, limiter, cache, stage), 1
+    except requests.HTTPError as e:
+        if url == plain_url or e.response is None or e.response.status_code != 400:
+            raise
+    return fetch_text(session, plain_url, limiter, cache, stage), 2
+
+def _embedded_list(obj, key):
+    # DSpace embeds a relation either as a plain list or as a page {"_embedded": {key: [...]}, "page": {...}};
+    # None when it is missing or only partially embedded
+    emb = (obj.get("_embedded") or {}).get(key)
+    if isinstance(emb, dict):
+        items = (emb.get("_embedded") or {}).get(key)
+        total = (emb.get("page") or {}).get("totalElements")
+        if not isinstance(items, list) or (total is not None and total > len(items)):
+            return None
+        return items
+    return emb if isinstance(emb, list) else None
+
+def embedded_bundle_entries(obj):
+    # [(bundle uuid, bitstream listing or None)] for the bundles embedded in an item or bundle listing,
+    # or None when the server did not embed them. The listing has the same shape as a decoded
+    # /bundles/{uuid}/bitstreams response so it goes through the same parser.
+    bundles = _embedded_list(obj, "bundles")
+    if bundles is None:
+        return None
+    entries = []
+    for b in bundles:
+        if not b.get("uuid"):
+            continue
+        bitstreams = _embedded_list(b, "bitstreams")
+        listing = {"name": b.get("name"), "_embedded": {"bitstreams": bitstreams}} if bitstreams is not None else None
+        entries.append((b["uuid"], listing))
+    return entries
+
+def parse_search_page(text):
+    # (total pages or None, item uuid -> embedded bundle entries) from one decoded search response. The
+    # page count is read from searchResult.page only: embedded bundle pages carry a totalPages of their own.
+    try:
+        result = json_loads(text)["_embedded"]["searchResult"]
+    except (ValueError, KeyError, TypeError):
+        return None, {}
+    total_pages = (result.get("page") or {}).get("totalPages")
+    embeds = {}
+    for obj in (result.get("_embedded") or {}).get("objects") or []:
+        item = (obj.get("_embedded") or {}).get("indexableObject") or {}
+        entries = embedded_bundle_entries(item)
+        if item.get("uuid") and entries is not None:
+            embeds[item["uuid"]] = entries
+    return total_pages if isinstance(total_pages, int) else None, embeds
+
+def iter_search_pages(session, limiter, cache, runs, page_size=SEARCH_PAGE_SIZE, embed=True):
+    # yields (run, page number, total pages, item uuids or None if the page failed, embedded bundles by
+    # item uuid) for every course in runs, one page at a time. The following page is already being fetched
+    # while the caller works on the current one, and only the parsed results are kept from each body.
+    from concurrent.futures import ThreadPoolExecutor
+    def fetch_page(run, page):
+        text, requests_made = fetch_embed_text(session, search_url(run.course_id, page, page_size, embed),
+                                               search_url(run.course_id, page, page_size, False), limiter, cache, "search")
+        run.bump("requests", requests_made)
+        uuids = dedupe(item_uuid_re.findall(text))
+        total_pages, embeds = parse_search_page(text)
+        if total_pages is None:
+            total_pages = page + 2 if len(uuids) >= page_size else page + 1
+        return uuids, total_pages, embeds if embed else {}
+
+    def following(idx, page, total_pages):
+        if page + 1 < total_pages:
+            return idx, page + 1
+        if idx + 1 < len(runs):
+            return idx + 1, 0
+        return None
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        current = (0, 0) if runs else None
+        pending = ex.submit(fetch_page, runs[0], 0) if runs else None
+        while current:
+            idx, page = current
+            try:
+                uuids, total_pages, embeds = pending.result()
+            except Exception:
+                uuids, total_pages, embeds = None, page + 1, {}
+            current = following(idx, page, total_pages)
+            if current:
+                pending = ex.submit(fetch_page, runs[current[0]], current[1])
+            yield runs[idx], page, total_pages, uuids, embeds
+
+class CourseRun:
+    # per-course state within a (possibly multi-course) pipeline run
+    def __init__(self, course_id, base_dir, sync=False, create_dir=True, download_dir=None):
+        self.course_id = course_id
+        if download_dir:
+            self.download_dir = pathlib.Path(download_dir)
+        else:
+            if sync:
+                folder_name = sanitize_filename(course_id)
+            else:
+                stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+                folder_name = f"{sanitize_filename(course_id)}_{stamp}"
+            self.download_dir = pathlib.Path(base_dir) / folder_name
+        if create_dir:
+            ensure_dir(self.download_dir)
+        self.manifest = SyncManifest(self.download_dir) if sync else None
+        self.namer = JobNamer(self.download_dir, self.manifest.names() if self.manifest else ())
+        self.item_uuids = []
+        self.stats = {"planned": 0, "planned_bytes": 0, "over_budget": 0, "downloaded": 0, "bytes": 0, "skipped_bundles": 0, "failed_requests": 0, "requests": 0, "requests_saved": 0,
+                      "added": 0, "updated": 0, "unchanged": 0, "removed": 0, "cross_listed": 0, "deduplicated": 0,
+                      "retried": 0, "failed_auth": 0, "failed_permanent": 0, "failed_transient": 0}
+        self.lock = threading.Lock()
+
+    def bump(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def finish(self, prune=False):
+        if not self.manifest:
+            return
+        # a failed or skipped listing would look like a removal, so only prune after a complete crawl
+        if prune and not self.stats["failed_requests"]:
+            self.stats["removed"] = self.manifest.prune()
+        self.manifest.save()
+
+def run_pipeline(session, limiter, runs, cache=None, download=True, page_size=SEARCH_PAGE_SIZE, embed=True, progress=None, concurrency=None,
+                 cookie_header=None, on_result=None, content=None, plan_only=False, max_bytes=None, archive=None, journal=None, jobs=None,
+                 close_pool=True, stop=None):
+    # search -> bundles -> bitstreams -> downloads for every course in runs, each stage connected by a
+    # bounded queue so a paper can start downloading as soon as its own metadata is in. All courses share
+    # the session, limiter and download workers; an item listed under several courses has its metadata
+    # fetched once and each bitstream downloaded once, then hard-linked into every other course that lists
+    # it and recorded in that course's manifest. With embed, bundles and bitstream listings that the server embeds in
+    # search or bundle responses are used directly instead of one request per item and per bundle.
+    # Downloads run on concurrency.max_limit workers, of which the AdaptiveConcurrency lets `limit` run.
+    # on_result, if given, gets a PaperResult for every paper as soon as its outcome is known. With a
+    # ContentStore, papers whose bytes are already on disk or being fetched are hard-linked, not downloaded.
+    # Downloads are handed out largest first. max_bytes caps the bytes planned for download across all
+    # courses (first fit, in the order papers are found); plan_only reports each paper's planned outcome
+    # without downloading or linking anything. With an ArchiveWriter, papers go into the archive under
+    # "<course folder>/<file name>" instead of into the course folders. Downloads that fail transiently are
+    # retried in up to DOWNLOAD_RETRIES rounds after the main pass, with exponential backoff between rounds;
+    # whatever still fails goes into the FailureJournal. With jobs (a list of (run, job) from the journal),
+    # search and metadata are skipped and only those downloads run. close_pool=False keeps the idle
+    # keep-alive download connections open for the next run. Setting stop (a threading.Event) ends the run
+    # early: no further requests or downloads start, and those in flight finish.
+    stages = progress or StageProgress()
+    stop = stop or threading.Event()
+    concurrency = concurrency or AdaptiveConcurrency()
+    # without a ContentStore from the caller, a private one still makes cross-listed bitstreams (keyed by
+    # uuid rather than checksum) download once
+    store = content or ContentStore()
+    for run in (runs if content else ()):
+        for entry in (run.manifest.entries.values() if run.manifest else ()):
+            key = content_key("md5", entry.get("checksum"))
+            if key and os.path.isfile(run.download_dir / entry["path"]):
+                store.seed(key, run.download_dir / entry["path"])
+    item_q, bundle_q = (queue.Queue(PIPELINE_QUEUE_SIZE) for _ in range(2))
+    # unbounded, so every job found so far competes for the next free worker by size
+    job_q = LargestFirstQueue()
+    # item uuid -> the courses that list it (the first one fetches its metadata), the bitstreams listed so
+    # far and whether any of its metadata requests failed
+    shared_items = {}
+    claim_lock = threading.Lock()
+    budget = {"bytes": 0}
+    retry_q = []
+
+    def claim_item(run, item_uuid):
+        # True if run is the first course to list the item; a later course joins it instead and is
+        # planned the bitstreams already listed, and those listed from now on
+        with claim_lock:
+            shared = shared_items.get(item_uuid)
+            if shared is None:
+                shared_items[item_uuid] = {"runs": [run], "records": [], "failed": False}
+                return True
+            shared["runs"].append(run)
+            records, failed = list(shared["records"]), shared["failed"]
+        if failed:
+            run.bump("failed_requests")
+        plan_bitstreams(run, item_uuid, records, cross_listed=True)
+        return False
+
+    def item_failed(item_uuid):
+        # a course missing part of an item's listing must not prune, whichever course fetched it
+        with claim_lock:
+            shared = shared_items[item_uuid]
+            shared["failed"] = True
+            item_runs = list(shared["runs"])
+        for run in item_runs:
+            run.bump("failed_requests")
+
+    def handle_item(entry):
+        run, item_uuid, entries = entry
+        if stop.is_set():
+            return
+        if entries is not None:
+            run.bump("requests_saved", 1 + sum(1 for _, listing in entries if listing is not None))
+        else:
+            try:
+                text, requests_made = fetch_embed_text(session, item_bundles_url(item_uuid, embed), item_bundles_url(item_uuid, False), limiter, cache, "items")
+                run.bump("requests", requests_made)
+                entries = None
+                if embed:
+                    try:
+                        entries = embedded_bundle_entries(json_loads(text))
+                    except (ValueError, AttributeError):
+                        entries = None
+                if entries is None:
+                    entries = [(b, None) for b in dedupe(bundle_uuid_re.findall(text))]
+                else:
+                    run.bump("requests_saved", sum(1 for _, t in entries if t is not None))
+            except Exception:
+                item_failed(item_uuid)
+                entries = []
+        stages.add("Bundles", len(entries))
+        for bundle_uuid, listing in entries:
+            bundle_q.put((run, item_uuid, bundle_uuid, listing))
+        stages.step("Items")
+
+    def handle_bundle(entry):
+        run, item_uuid, bundle_uuid, listing = entry
+        if stop.is_set():
+            return
+        try:
+            if listing is None:
+                listing = fetch_text(session, f"{BASE_URL}/server/api/core/bundles/{bundle_uuid}/bitstreams", limiter, cache, "bundles")
+                run.bump("requests")
+            records = parse_bitstreams(listing)
         except Exception:
-            return False, job
-
-    if step4_total:
-        with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as ex:
-            futures = [ex.submit(_task, job) for job in download_jobs]
-            for fut in as_completed(futures):
-                ok, _ = fut.result()
-                if ok:
-                    downloaded_success += 1
-                step4_done += 1
-                progress("Step 4/4 (Downloading PDFs)", step4_done, step4_total)
-    print()
+            item_failed(item_uuid)
+            records = []
+        if records is None:
+            run.bump("skipped_bundles")
+            records = []
+        with claim_lock:
+            shared = shared_items[item_uuid]
+            shared["records"].extend(records)
+            item_runs = list(shared["runs"])
+        for i, item_run in enumerate(item_runs):
+            plan_bitstreams(item_run, item_uuid, records, cross_listed=i > 0)
+        stages.step("Bundles")
+
+    def plan_bitstreams(run, item_uuid, records, cross_listed=False):
+        manifest = run.manifest
+        for bs in records:
+            if cross_listed:
+                run.bump("cross_listed")
+            run.bump("planned")
+            if manifest and manifest.is_current(bs.uuid, bs.size_bytes, bs.checksum):
+                # only now is the local copy known to match upstream, so only now may other courses link to it
+                store.seed(f"bitstream:{bs.uuid}", manifest.path_for(bs.uuid))
+                run.bump("unchanged")
+                if journal:
+                    journal.resolve(run.course_id, bs.uuid)
+                if on_result:
+                    on_result(PaperResult(run.course_id, bs.uuid, bs.name, str(manifest.path_for(bs.uuid)), bs.size_bytes, bs.md5, "unchanged", item_uuid))
+                continue
+            out_path = (manifest and manifest.path_for(bs.uuid)) or run.namer.claim(bs.name, bs.uuid)
+            if archive:
+                out_path = f"{run.download_dir.name}/{out_path.name}"
+            download_url = f"{BASE_URL}/server/api/core/bitstreams/{bs.uuid}/content"
+            if download:
+                stages.add("Downloads")
+                key = (content and content_key(bs.checksum_algorithm, bs.checksum)) or f"bitstream:{bs.uuid}"
+                plan_job(run, {"uuid": bs.uuid, "item": item_uuid, "name": bs.name, "url": download_url, "path": str(out_path), "size": bs.size_bytes,
+                               "checksum": bs.checksum, "md5": bs.md5, "key": key, "cross_listed": cross_listed})
+            elif on_result:
+                on_result(PaperResult(run.course_id, bs.uuid, bs.name, str(out_path), bs.size_bytes, bs.md5, "listed", item_uuid))
+
+    def plan_job(run, job, retry=False):
+        # a retried job that still holds its reservation goes straight back on the queue; one that is now
+        # linked to, or waits on, another download gives its reservation back
+        state, stored_path = store.claim(job["key"], (run, job)) if job["key"] else ("download", None)
+        if state == "stored" and not (plan_only or archive) and job["size"] is not None and file_size(stored_path) != job["size"]:
+            state = "download"  # the stored copy was removed or replaced since it was indexed
+        elif state == "stored" and os.path.abspath(stored_path) == os.path.abspath(job["path"]):
+            state = "download"  # the stale copy this job is here to replace
+        if state != "download":
+            release_bytes(job)
+        if state == "stored":
+            link_job(run, job, stored_path)
+        elif state == "download" and retry and job.get("reserved"):
+            job_q.put((run, job))
+        elif state == "download":
+            schedule_job(run, job)
 
-    print("\n===== Paper Download Summary =====")
-    print(f"Total papers found:               {len(item_uuids)}")
+    def reserve_bytes(run, job):
+        size = job["size"] or 0
+        with claim_lock:
+            if max_bytes is not None and budget["bytes"] + size > max_bytes:
+                return False
+            budget["bytes"] += size
+            first = "reserved" not in job
+            job["reserved"] = True
+        if first:
+            run.bump("planned_bytes", size)
+        stages.add_bytes(size)
+        return True
+
+    def release_bytes(job):
+        # gives a job's reservation back, once: when it finally fails, or when its content key is released
+        # to duplicates, so the same bytes are never counted against max_bytes twice
+        size = job["size"] or 0
+        with claim_lock:
+            if not job.get("reserved"):
+                return
+            job["reserved"] = False
+            budget["bytes"] -= size
+        stages.add_bytes(-size)
+
+    def schedule_job(run, job):
+        if not reserve_bytes(run, job):
+            run.bump("over_budget")
+            finish_job(run, job, None, "skipped")
+            promoted = store.failed(job["key"]) if job["key"] else None
+            if promoted:
+                schedule_job(*promoted)
+        elif plan_only:
+            finish_job(run, job, None, "planned")
+            for waiting_run, waiting_job in (store.stored(job["key"], job["path"]) if job["key"] else ()):
+                link_job(waiting_run, waiting_job, job["path"])
+        else:
+            job_q.put((run, job))
+
+    def finish_job(run, job, result, status):
+        if journal and status in ("downloaded", "linked"):
+            journal.resolve(run.course_id, job["uuid"])
+        if result:
+            run.bump("downloaded")
+            if run.manifest:
+                run.bump("updated" if run.manifest.path_for(job["uuid"]) else "added")
+                run.manifest.record(job["uuid"], job["path"], result[0], job["checksum"] or result[1])
+        if on_result:
+            size, md5 = result or (job["size"], job["md5"])
+            on_result(PaperResult(run.course_id, job["uuid"], job["name"], job["path"], size, md5, status, job.get("item")))
+        stages.step("Downloads")
+
+    def link_job(run, job, stored_path):
+        if plan_only:
+            return finish_job(run, job, None, "linked")
+        if archive:
+            archive.add_link(job["path"], stored_path, course_id=run.course_id, uuid=job["uuid"], md5=job["md5"])
+            size = job["size"] or 0
+        else:
+            try:
+                link_or_copy(stored_path, job["path"])
+            except OSError:
+                return finish_job(run, job, None, "failed")
+            size = os.path.getsize(job["path"])
+        if not job.get("cross_listed"):
+            run.bump("deduplicated")
+        store.count("linked")
+        store.count("bytes_not_downloaded", size)
+        finish_job(run, job, (size, job["md5"]), "linked")
+
+    def handle_job(entry):
+        run, job = entry
+        if stop.is_set():
+            return
+        sink = archive.spool() if archive else None
+        result = download_job(job, concurrency, cookie_header, sink)
+        if result:
+            run.bump("bytes", result[0])
+            stages.step_bytes(result[0])
+        earlier = None
+        if result and content and not job["checksum"]:
+            earlier = content.add_downloaded(content_key("md5", result[1]), job["path"])
+        if result and archive:
+            meta = {"course_id": run.course_id, "uuid": job["uuid"], "md5": result[1]}
+            if earlier:
+                archive.add_link(job["path"], earlier, **meta)
+                run.bump("deduplicated")
+                content.count("linked_after_download")
+                if archive.format == "tar":
+                    content.count("bytes_not_stored", result[0])
+            else:
+                archive.add(job["path"], sink, **meta)
+                sink = None
+        elif earlier:
+            # same bytes as a file already stored; keep one copy on disk
+            try:
+                link_or_copy(earlier, job["path"])
+                run.bump("deduplicated")
+                content.count("linked_after_download")
+                content.count("bytes_not_stored", result[0])
+            except OSError:
+                pass
+        if sink is not None:
+            sink.close()
+        if result:
+            finish_job(run, job, result, "downloaded")
+        elif job.get("error") == "transient" and job.get("attempts", 0) < DOWNLOAD_RETRIES:
+            with claim_lock:
+                retry_q.append((run, job))
+        else:
+            run.bump(f"failed_{job.get('error') or 'transient'}")
+            release_bytes(job)
+            if journal:
+                journal.record(run, job)
+            finish_job(run, job, None, "failed")
+        if job["key"]:
+            if result:
+                for waiting_run, waiting_job in store.stored(job["key"], job["path"]):
+                    link_job(waiting_run, waiting_job, job["path"])
+            else:
+                # the key is free again, and whichever duplicate downloads it next reserves its own bytes; if
+                # this job is retried it reserves again only if it still has to download
+                release_bytes(job)
+                promoted = store.failed(job["key"])
+                if promoted:
+                    schedule_job(*promoted)
+
+    item_workers = start_workers(limiter.max_inflight, item_q, handle_item)
+    bundle_workers = start_workers(limiter.max_inflight, bundle_q, handle_bundle)
+    download_workers = start_workers(concurrency.max_limit, job_q, handle_job)
+
+    for run, job in jobs or ():
+        run.bump("planned")
+        stages.add("Downloads")
+        plan_job(run, job)
+    run_items = {run: set() for run in runs}
+    search_pages = {run: 0 for run in runs}
+    for run, page, total_pages, uuids, embeds in (iter_search_pages(session, limiter, cache, runs, page_size, embed) if jobs is None else ()):
+        if stop.is_set():
+            break
+        # every page carries its own page count (or an estimate), so keep the stage total in step with the latest
+        pages = max(1, page + 1, total_pages)
+        stages.add("Search", pages - search_pages[run])
+        search_pages[run] = pages
+        stages.step("Search")
+        if uuids is None:
+            run.bump("failed_requests")
+            continue
+        uuids = [u for u in uuids if u not in run_items[run]]
+        run_items[run].update(uuids)
+        run.item_uuids.extend(uuids)
+        fresh = [u for u in uuids if claim_item(run, u)]
+        stages.add("Items", len(fresh))
+        for item_uuid in fresh:
+            item_q.put((run, item_uuid, embeds.get(item_uuid)))
+    close_workers(item_q, item_workers)
+    close_workers(bundle_q, bundle_workers)
+    close_workers(job_q, download_workers)
+    for attempt in range(DOWNLOAD_RETRIES):
+        pending, retry_q[:] = list(retry_q), []
+        if not pending or stop.wait(DOWNLOAD_BACKOFF_SECONDS * 2 ** attempt):
+            break
+        download_workers = start_workers(concurrency.max_limit, job_q, handle_job)
+        run_metrics.retried("downloads", len(pending))
+        for run, job in pending:
+            run.bump("retried")
+            job["attempts"] = job.get("attempts", 0) + 1
+            # a duplicate may have been fetched in the meantime; then this one is just linked to it
+            plan_job(run, job, retry=True)
+        close_workers(job_q, download_workers)
+    if close_pool:
+        download_pool.close()
+    if not stages.quiet:
+        print()
+    return stages
+
+class Crawler:
+    # importable entry point. papers() runs the whole pipeline for course_ids and yields a PaperResult per
+    # paper as it completes; on_progress(stage, done, total) follows the stage counters. The base URL,
+    # connection pool and metrics are module-wide, so run one crawl at a time per process. Downloads that
+    # still fail are written to the journal; retry_failed replays only those (for course_ids, if given).
+    # A long-lived caller can pass its own session and MetadataCache (which the crawl then leaves open)
+    # and keep_connections=True, so consecutive crawls share them. Leaving papers() early (break, or
+    # closing the generator) stops the crawl and waits for downloads in flight; nothing is pruned then.
+    def __init__(self, cookie_header, course_ids, base_dir=None, base_url=None, sync=False, prune=False, offline=False,
+                 cache=True, cache_ttl=CACHE_TTL_SECONDS, embed=True, page_size=SEARCH_PAGE_SIZE,
+                 min_downloads=MIN_DOWNLOAD_WORKERS, max_downloads=MAX_DOWNLOAD_WORKERS, deduplicate=True, max_bytes=None, dry_run=False,
+                 archive=None, retry_failed=False, journal=FAILURE_JOURNAL_PATH, session=None, metadata_cache=None, keep_connections=False,
+                 on_progress=None, quiet=True):
+        self.cookie_header = cookie_header
+        self.course_ids = dedupe(c.strip() for c in course_ids if c.strip())
+        self.base_dir = pathlib.Path(base_dir) if base_dir else pathlib.Path(__file__).resolve().parent
+        self.base_url = (base_url or BASE_URL).rstrip("/")
+        self.sync = sync
+        self.prune = prune
+        self.offline = offline
+        self.use_cache = cache or offline
+        self.cache_ttl = cache_ttl
+        self.embed = embed
+        self.page_size = max(1, page_size)
+        self.max_bytes = max_bytes
+        self.dry_run = dry_run
+        self.archive_path = pathlib.Path(archive) if archive and not retry_failed else None
+        self.retry_failed = retry_failed
+        self.journal_path = journal
+        if retry_failed and not journal:
+            raise ValueError("retry_failed needs a failure journal")
+        self.journal = None
+        self.session = session
+        self.shared_cache = metadata_cache
+        self.keep_connections = keep_connections
+        self.concurrency = AdaptiveConcurrency(min_downloads, max_downloads)
+        self.content = ContentStore() if deduplicate else None
+        self.stages = StageProgress(quiet=quiet, callback=on_progress)
+        self.runs = []
+        self.cache = None
+        self.elapsed = 0.0
+
+    def papers(self):
+        if self.shared_cache:
+            self.cache = self.shared_cache
+        else:
+            self.cache = MetadataCache(ttl=self.cache_ttl, offline=self.offline) if self.use_cache else None
+        writes = not (self.offline or self.dry_run)
+        self.journal = FailureJournal(self.journal_path) if self.journal_path else None
+        jobs = None
+        if self.retry_failed:
+            runs, jobs = {}, []
+            for e in self.journal.pending(self.course_ids):
+                if e["download_dir"] not in runs:
+                    runs[e["download_dir"]] = CourseRun(e["course_id"], self.base_dir, sync=e["sync"], create_dir=writes, download_dir=e["download_dir"])
+                jobs.append((runs[e["download_dir"]], {k: e.get(k) for k in FailureJournal.JOB_FIELDS}))
+            self.runs = list(runs.values())
+        else:
+            self.runs = [CourseRun(c, self.base_dir, sync=self.sync, create_dir=writes and not self.archive_path) for c in self.course_ids]
+        results = queue.Queue()
+        outcome = {}
+        stop = threading.Event()
+
+        def work():
+            start = time.monotonic()
+            # the writer queue holds up to one paper per download worker, matching the README's memory bound
+            archive = ArchiveWriter(self.archive_path, queue_size=self.concurrency.max_limit) if self.archive_path and writes else None
+            try:
+                run_pipeline(self.session or make_session(self.cookie_header), RateLimiter(), self.runs, cache=self.cache, download=not self.offline,
+                             page_size=self.page_size, embed=self.embed, progress=self.stages, concurrency=self.concurrency,
+                             cookie_header=self.cookie_header, on_result=results.put, content=self.content,
+                             plan_only=self.dry_run, max_bytes=self.max_bytes, archive=archive,
+                             journal=self.journal if writes else None, jobs=jobs, close_pool=not self.keep_connections, stop=stop)
+                if archive:
+                    archive.close()
+                for run in self.runs:
+                    if writes:
+                        # a replay only sees the journalled papers and a stopped crawl only part of the
+                        # listing, so nothing may be pruned then
+                        run.finish(prune=self.prune and not self.retry_failed and not stop.is_set())
+                if self.journal and writes:
+                    self.journal.save()
+            except BaseException as e:
+                outcome["error"] = e
+                if archive:
+                    # still finish the papers already handed over, with their index, and release the writer
+                    with contextlib.suppress(Exception):
+                        archive.close()
+            finally:
+                self.elapsed = time.monotonic() - start
+                if self.cache and self.cache is not self.shared_cache:
+                    self.cache.close()
+                results.put(_STOP)
+
+        global BASE_URL
+        previous_base_url, BASE_URL = BASE_URL, self.base_url
+        worker = threading.Thread(target=work, daemon=True)
+        worker.start()
+        try:
+            while (result := results.get()) is not _STOP:
+                yield result
+        finally:
+            # also runs when the caller stops iterating early
+            stop.set()
+            worker.join()
+            BASE_URL = previous_base_url
+        if "error" in outcome:
+            raise outcome["error"]
+
+    def run(self):
+        # crawls to completion; returns every PaperResult
+        return list(self.papers())
+
+    def report(self):
+        return build_run_report(self.runs, self.stages, self.elapsed, self.cache, concurrency=self.concurrency, content=self.content, journal=self.journal)
+
+def extract_pdf_text(path):
+    # runs in a PaperIndex worker process; needs the optional pypdf package. Scans without a text layer give ""
+    from pypdf import PdfReader
+    return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+class PaperIndex:
+    # SQLite FTS5 full-text index over downloaded papers, tagged with course ID, item and bitstream uuid and
+    # file name. update() only extracts files whose size or mtime changed since they were indexed (and
+    # reuses the text of an already indexed copy with the same MD5); search() ranks hits by BM25, with
+    # matches in the file name weighted above matches in the text.
+    FILENAME_WEIGHT = 5.0
+
+    def __init__(self, path=INDEX_PATH):
+        import sqlite3
+        self.path = pathlib.Path(path)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("""CREATE TABLE IF NOT EXISTS papers (
+            id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, md5 TEXT,
+            course_id TEXT, item_uuid TEXT, bitstream_uuid TEXT, filename TEXT NOT NULL, indexed_at REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS papers_md5 ON papers (md5)")
+        self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(text, filename)")
+        self.db.commit()
+
+    def update(self, papers, workers=None):
+        # papers: PaperResults (other statuses than downloaded/linked/unchanged are ignored); returns counts
+        from concurrent.futures import ProcessPoolExecutor
+        stats = {"indexed": 0, "reused": 0, "unchanged": 0, "failed": 0, "removed": self._drop_missing()}
+        todo, same_md5 = {}, {}
+        for p in papers:
+            if p.status not in ("downloaded", "linked", "unchanged"):
+                continue
+            try:
+                st = os.stat(p.path)
+            except OSError:
+                continue
+            row = self.db.execute("SELECT size, mtime_ns FROM papers WHERE path = ?", (p.path,)).fetchone()
+            if row == (st.st_size, st.st_mtime_ns):
+                stats["unchanged"] += 1
+                continue
+            text = self._text_for_md5(p.md5)
+            if text is not None:
+                self._store(p, st, text)
+                stats["reused"] += 1
+            elif p.md5 in same_md5:
+                # another copy of these bytes is extracted in this batch
+                same_md5[p.md5].append((p, st))
+            else:
+                todo[p.path] = (p, st)
+                if p.md5:
+                    same_md5[p.md5] = []
+        if todo:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {path: pool.submit(extract_pdf_text, path) for path in todo}
+                for path, future in futures.items():
+                    try:
+                        text = future.result()
+                    except ImportError:
+                        raise
+                    except Exception:
+                        stats["failed"] += 1
+                        continue
+                    paper, st = todo[path]
+                    self._store(paper, st, text)
+                    stats["indexed"] += 1
+                    for copy, copy_st in same_md5.get(paper.md5, ()):
+                        self._store(copy, copy_st, text)
+                        stats["reused"] += 1
+        self.db.commit()
+        return stats
+
+    def _drop_missing(self):
+        gone = [(i,) for i, path in self.db.execute("SELECT id, path FROM papers").fetchall() if not os.path.exists(path)]
+        self.db.executemany("DELETE FROM papers WHERE id = ?", gone)
+        self.db.executemany("DELETE FROM papers_fts WHERE rowid = ?", gone)
+        return len(gone)
+
+    def _text_for_md5(self, md5):
+        if not md5:
+            return None
+        row = self.db.execute("SELECT f.text FROM papers p JOIN papers_fts f ON f.rowid = p.id WHERE p.md5 = ? LIMIT 1", (md5,)).fetchone()
+        return row[0] if row else None
+
+    def _store(self, paper, st, text):
+        filename = os.path.basename(paper.path)
+        row = self.db.execute("SELECT id FROM papers WHERE path = ?", (paper.path,)).fetchone()
+        if row:
+            self.db.execute("DELETE FROM papers_fts WHERE rowid = ?", row)
+            self.db.execute("""UPDATE papers SET size = ?, mtime_ns = ?, md5 = ?, course_id = ?, item_uuid = ?, bitstream_uuid = ?,
+                               filename = ?, indexed_at = ? WHERE id = ?""",
+                            (st.st_size, st.st_mtime_ns, paper.md5, paper.course_id, paper.item_uuid, paper.uuid, filename, time.time(), row[0]))
+            rowid = row[0]
+        else:
+            rowid = self.db.execute("""INSERT INTO papers (path, size, mtime_ns, md5, course_id, item_uuid, bitstream_uuid, filename, indexed_at)
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                    (paper.path, st.st_size, st.st_mtime_ns, paper.md5, paper.course_id, paper.item_uuid, paper.uuid,
+                                     filename, time.time())).lastrowid
+        self.db.execute("INSERT INTO papers_fts (rowid, text, filename) VALUES (?, ?, ?)", (rowid, text, filename))
+
+    def search(self, query, limit=20, course_ids=()):
+        # every word in query must match (prefix matches count); returns dicts, most relevant first
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        sql = f"""SELECT p.course_id, p.item_uuid, p.bitstream_uuid, p.filename, p.path, bm25(papers_fts, 1.0, {self.FILENAME_WEIGHT}) AS score,
+                         snippet(papers_fts, 0, '[', ']', '...', 12)
+                  FROM papers_fts JOIN papers p ON p.id = papers_fts.rowid WHERE papers_fts MATCH ?"""
+        params = [" ".join(f'"{t}"*' for t in terms)]
+        if course_ids:
+            sql += f" AND p.course_id IN ({','.join('?' * len(course_ids))})"
+            params += list(course_ids)
+        sql += " ORDER BY score LIMIT ?"
+        rows = self.db.execute(sql, [*params, limit]).fetchall()
+        keys = ("course_id", "item_uuid", "uuid", "filename", "path", "score", "snippet")
+        # bm25() is lower for better matches; report it as a positive relevance
+        return [{**dict(zip(keys, r)), "score": -r[5]} for r in rows]
+
+    def close(self):
+        self.db.close()
+
+def print_search_hits(hits, elapsed):
+    for h in hits:
+        print(f"{h['course_id'] or '?':<10} {h['filename']}  ({h['score']:.2f})")
+        print(f"           {' '.join(h['snippet'].split())}")
+        print(f"           {h['path']}")
+    print(f"{len(hits)} hit(s) in {elapsed * 1000:.1f} ms\n")
+
+def read_course_ids(args):
+    course_ids = [c.strip() for c in args.course_ids]
+    if args.courses_file:
+        with open(args.courses_file, encoding="utf-8") as f:
+            course_ids += [line.split("#", 1)[0].strip() for line in f]
+    return dedupe(c for c in course_ids if c)
+
+def print_course_summary(run, offline=False, dry_run=False, archive=None):
+    stats = run.stats
+    total_planned = stats["planned"]
+    downloaded_success = stats["downloaded"]
+    print(f"\n===== Paper Download Summary: {run.course_id} =====")
+    print(f"Total papers found:               {len(run.item_uuids)}")
     print(f"Total available papers:           {total_planned}")
     print(f"Total available papers downloaded:{downloaded_success}")
-    print(f"Total unavailable papers:         {len(item_uuids) - total_planned}")
+    print(f"Total unavailable papers:         {len(run.item_uuids) - total_planned}")
+    if stats["cross_listed"]:
+        print(f"Cross-listed (shared, linked):    {stats['cross_listed']}")
+    if stats["deduplicated"]:
+        print(f"Duplicates hard-linked:           {stats['deduplicated']}")
+    if stats["failed_requests"]:
+        print(f"Failed metadata requests:         {stats['failed_requests']}")
+    failed = stats["failed_auth"] + stats["failed_permanent"] + stats["failed_transient"]
+    if failed or stats["retried"]:
+        print(f"Failed downloads:                 {failed} ({stats['failed_auth']} auth, {stats['failed_permanent']} not found, "
+              f"{stats['failed_transient']} transient; {stats['retried']} retries)")
+    print(f"Metadata requests:                {stats['requests']} ({stats['requests_saved']} saved by embeds)")
+    if stats["planned_bytes"]:
+        print(f"Planned download size:            {stats['planned_bytes'] / 1e6:.1f} MB")
+    if stats["over_budget"]:
+        print(f"Skipped (over --max-bytes):       {stats['over_budget']}")
+    if run.manifest:
+        print(f"Sync:                             {stats['added']} added, {stats['updated']} updated, {stats['unchanged']} unchanged, {stats['removed']} removed")
     print("----------------------------------")
-    print(f"Downloaded {downloaded_success} out of {total_planned} available paper(s).")
-    print(f"Saved to: {download_dir}\n")
+    if offline:
+        print(f"Offline: {total_planned} available paper(s) listed from cache, nothing downloaded.\n")
+        return
+    if dry_run:
+        print(f"Dry run: {stats['planned_bytes'] / 1e6:.1f} MB planned, nothing downloaded.\n")
+        return
+    if run.manifest:
+        print(f"Downloaded {downloaded_success} out of {total_planned - stats['unchanged']} new or changed paper(s).")
+    else:
+        print(f"Downloaded {downloaded_success} out of {total_planned} available paper(s).")
+    print(f"Saved to: {archive or run.download_dir}\n")
+
+def print_batch_summary(runs, elapsed):
+    total_bytes = sum(r.stats["bytes"] for r in runs)
+    downloaded = sum(r.stats["downloaded"] for r in runs)
+    print("===== Batch Summary =====")
+    print(f"Courses:                          {len(runs)}")
+    print(f"Papers downloaded:                {downloaded}")
+    print(f"Cross-listed papers fetched once: {sum(r.stats['cross_listed'] for r in runs)}")
+    print(f"Duplicate papers hard-linked:     {sum(r.stats['deduplicated'] for r in runs)}")
+    print(f"Failed metadata requests:         {sum(r.stats['failed_requests'] for r in runs)}")
+    print(f"Metadata requests:                {sum(r.stats['requests'] for r in runs)} ({sum(r.stats['requests_saved'] for r in runs)} saved by embeds)")
+    print(f"Data downloaded:                  {total_bytes / 1e6:.1f} MB")
+    print(f"Elapsed:                          {elapsed:.1f} s")
+    if elapsed > 0:
+        print(f"Throughput:                       {total_bytes / 1e6 / elapsed:.2f} MB/s, {downloaded / elapsed:.2f} papers/s")
+    print()
+
+def print_plan(results):
+    # the dry-run plan in the order downloads would be handed out (largest first)
+    planned = sorted((p for p in results if p.status == "planned"), key=lambda p: (p.size_bytes is None, -(p.size_bytes or 0)))
+    print("===== Download Plan =====")
+    for p in planned:
+        size = "?" if p.size_bytes is None else f"{p.size_bytes / 1e6:.2f}"
+        print(f"{size:>9} MB  {p.course_id:<10} {os.path.basename(p.path)}")
+    counts = {s: sum(1 for p in results if p.status == s) for s in ("linked", "unchanged", "skipped")}
+    print(f"Planned: {len(planned)} paper(s), {sum(p.size_bytes or 0 for p in planned) / 1e6:.1f} MB; "
+          f"{counts['linked']} duplicate(s) to link, {counts['unchanged']} unchanged, {counts['skipped']} over --max-bytes\n")
+
+def build_run_report(runs, stages, elapsed, cache=None, metrics=None, concurrency=None, content=None, journal=None):
+    metrics = metrics or run_metrics
+    return {
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "elapsed_s": round(elapsed, 3),
+        "courses": {r.course_id: {**r.stats, "items": len(r.item_uuids), "download_dir": str(r.download_dir)} for r in runs},
+        "stages": {s: {"done": stages.done[s], "total": stages.total[s], "wall_time_s": round(stages.wall_time(s), 3)} for s in stages.stages},
+        "requests": metrics.snapshot(),
+        "download_pool": dict(download_pool.stats),
+        "metadata_cache": dict(cache.stats) if cache else None,
+        "download_concurrency": concurrency.report() if concurrency else None,
+        "content_store": dict(content.stats) if content else None,
+        "failure_journal": {"path": str(journal.path), "entries": len(journal.entries)} if journal else None,
+    }
+
+def run_report_prometheus(report, metrics=None):
+    metrics = metrics or run_metrics
+    extra = [("run_duration_seconds", {}, report["elapsed_s"])]
+    extra += [("stage_wall_time_seconds", {"stage": s}, v["wall_time_s"]) for s, v in report["stages"].items()]
+    for course_id, stats in report["courses"].items():
+        for key in ("planned", "planned_bytes", "downloaded", "bytes", "failed_requests", "cross_listed", "deduplicated",
+                    "retried", "failed_auth", "failed_permanent", "failed_transient"):
+            extra.append((f"course_{key}", {"course": course_id}, stats[key]))
+    if report.get("download_concurrency"):
+        dc = report["download_concurrency"]
+        extra += [("download_concurrency_final", {}, dc["final"]), ("download_concurrency_peak", {}, dc["peak"]),
+                  ("downloads_throttled_total", {}, dc["throttled"]), ("download_backoff_seconds_total", {}, dc["backoff_s"])]
+    extra.append(("run_finished_timestamp_seconds", {}, round(time.time(), 3)))
+    help_texts = {"run_duration_seconds": "Wall time of the whole run.",
+                  "stage_wall_time_seconds": "Wall time of each pipeline stage, first item to last.",
+                  "download_concurrency_final": "Download concurrency limit at the end of the run.",
+                  "download_concurrency_peak": "Highest download concurrency limit reached.",
+                  "downloads_throttled_total": "Downloads answered with 429 or 503.",
+                  "download_backoff_seconds_total": "Time downloads were held back by Retry-After.",
+                  "run_finished_timestamp_seconds": "Unix time the run finished."}
+    help_texts.update((f"course_{key}", f"Per-course run statistic: {key.replace('_', ' ')}.") for key in
+                      ("planned", "planned_bytes", "downloaded", "bytes", "failed_requests", "cross_listed", "deduplicated",
+                       "retried", "failed_auth", "failed_permanent", "failed_transient"))
+    return metrics.prometheus(extra, help_texts)
+
+def write_text_atomic(path, text):
+    path = pathlib.Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+def parse_size(value):
+    # byte count with an optional K/M/G suffix (powers of 1000), e.g. 500M
+    value = value.strip().upper().removesuffix("B")
+    scale = {"K": 1e3, "M": 1e6, "G": 1e9}.get(value[-1:], 1)
+    try:
+        return int(float(value[:-1] if scale != 1 else value) * scale)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Download past exam papers for one or more courses from exampapers.ed.ac.uk.")
+    ap.add_argument("course_ids", nargs="*", metavar="COURSE_ID", help="course IDs, e.g. MATH08058 (prompted for if none given)")
+    ap.add_argument("--courses-file", help="file with one course ID per line (# starts a comment)")
+    ap.add_argument("--base-url", default=BASE_URL, help="exam papers site to crawl (default from EXAMPAPERS_BASE_URL)")
+    ap.add_argument("--page-size", type=int, default=SEARCH_PAGE_SIZE, help="search results requested per page")
+    ap.add_argument("--no-embed", action="store_true", help="fetch bundles and bitstreams with one request per object instead of embedding them")
+    ap.add_argument("--offline", action="store_true", help="serve metadata only from the local cache and skip downloads")
+    ap.add_argument("--no-cache", action="store_true", help="bypass the local metadata cache")
+    ap.add_argument("--cache-ttl", type=float, default=CACHE_TTL_SECONDS, help="seconds a cached response is used without revalidation")
+    ap.add_argument("--min-downloads", type=int, default=MIN_DOWNLOAD_WORKERS, help="lowest number of concurrent downloads (default %(default)s)")
+    ap.add_argument("--max-downloads", type=int, default=MAX_DOWNLOAD_WORKERS, help="highest number of concurrent downloads (default %(default)s)")
+    ap.add_argument("--no-dedupe", action="store_true", help="download every paper even when identical bytes are already stored")
+    ap.add_argument("--max-bytes", type=parse_size, help="download at most this many bytes (e.g. 500M); papers that do not fit are skipped")
+    ap.add_argument("--dry-run", action="store_true", help="print the download plan (largest first) and total size without downloading")
+    ap.add_argument("--archive", help="write every paper into this .zip or .tar file (with an index) instead of one file per paper")
+    ap.add_argument("--retry-failed", action="store_true", help="only retry the downloads recorded in the failure journal (no search or metadata requests)")
+    ap.add_argument("--index", action="store_true", help="add the text of new or changed papers to the local full-text index (needs pypdf)")
+    ap.add_argument("--search", metavar="QUERY", help="search the full-text index (limited to COURSE_IDs, if given) instead of crawling")
+    ap.add_argument("--limit", type=int, default=20, help="with --search, the number of hits to show (default %(default)s)")
+    ap.add_argument("--serve", action="store_true", help="run the local scrape service (HTTP/JSON API) instead of a one-off crawl")
+    ap.add_argument("--host", default="127.0.0.1", help="with --serve, the address to listen on (default %(default)s)")
+    ap.add_argument("--port", type=int, default=8765, help="with --serve, the port to listen on (default %(default)s)")
+    ap.add_argument("--fresh-for", type=float, default=300, help="with --serve, seconds a finished course crawl answers new requests (default %(default)s)")
+    ap.add_argument("--report", help="write a JSON run report (timings, statuses, retries, bytes per stage) to this path")
+    ap.add_argument("--prometheus", help="write the run metrics as a Prometheus text file to this path")
+    ap.add_argument("--sync", action="store_true", help="sync into a stable per-course folder, fetching only new or changed papers")
+    ap.add_argument("--prune", action="store_true", help="with --sync, delete papers that are no longer listed upstream")
+    return ap.parse_args(argv)
+
+def search_index(args):
+    if not INDEX_PATH.exists():
+        print("No full-text index yet; download with --index first."); return
+    index = PaperIndex()
+    start = time.perf_counter()
+    hits = index.search(args.search, args.limit, read_course_ids(args))
+    print_search_hits(hits, time.perf_counter() - start)
+    index.close()
+
+def update_index(results):
+    index = PaperIndex()
+    try:
+        stats = index.update(results)
+    except ImportError:
+        print("--index needs the pypdf package (pip install pypdf); the index was not updated.\n"); return
+    finally:
+        index.close()
+    print(f"Full-text index: {stats['indexed']} indexed, {stats['reused']} reused, {stats['unchanged']} unchanged, "
+          f"{stats['failed']} unreadable, {stats['removed']} removed\n")
+
+def main(argv=None, cookie_header=None):
+    args = parse_args(argv)
+    if args.search:
+        search_index(args); return
+    cookie_header = cookie_header or COOKIE_HEADER
+    if not cookie_header and not args.offline:
+        print("COOKIE_HEADER is not set; log in with main.py first."); return
+    if args.serve:
+        from ScrapeService import serve
+        serve(cookie_header, args); return
+    if args.offline and args.no_cache:
+        print("--offline needs the metadata cache."); return
+    if args.archive and (args.sync or args.retry_failed or not args.archive.lower().endswith((".zip", ".tar"))):
+        print("--archive needs a .zip or .tar path and cannot be combined with --sync or --retry-failed."); return
+    if args.retry_failed and args.offline:
+        print("--retry-failed downloads, so it cannot run --offline."); return
+    if args.index and args.archive:
+        print("--index reads the downloaded files, so it cannot be combined with --archive."); return
+    course_ids = read_course_ids(args)
+    if not course_ids and not args.retry_failed:
+        print("Enter Course ID (e.g., MATH08058): ", end="", flush=True)
+        course_ids = [c for c in [input().strip()] if c]
+    if not course_ids and not args.retry_failed:
+        print("No Course ID provided."); return
+
+    crawler = Crawler(cookie_header, course_ids, base_url=args.base_url, sync=args.sync, prune=args.prune, offline=args.offline,
+                      cache=not args.no_cache, cache_ttl=args.cache_ttl, embed=not args.no_embed, page_size=args.page_size,
+                      min_downloads=args.min_downloads, max_downloads=args.max_downloads, deduplicate=not args.no_dedupe,
+                      max_bytes=args.max_bytes, dry_run=args.dry_run, archive=args.archive, retry_failed=args.retry_failed, quiet=False)
+    print()
+    results = [p for p in crawler.papers() if args.dry_run or args.index]
+    runs, cache, elapsed = crawler.runs, crawler.cache, crawler.elapsed
+    if args.report or args.prometheus:
+        report = crawler.report()
+        if args.report:
+            write_text_atomic(args.report, json.dumps(report, indent=2))
+        if args.prometheus:
+            write_text_atomic(args.prometheus, run_report_prometheus(report))
+
+    if args.dry_run:
+        print_plan(results)
+    elif args.index and not args.offline:
+        update_index(results)
+    for run in runs:
+        print_course_summary(run, offline=args.offline, dry_run=args.dry_run, archive=args.archive)
+    if cache:
+        print(f"Metadata cache: {cache.stats['fresh']} fresh, {cache.stats['revalidated']} revalidated, {cache.stats['fetched']} fetched\n")
+    if len(runs) > 1:
+        print_batch_summary(runs, elapsed)
+    if args.retry_failed and not runs:
+        print("No failed downloads recorded.\n")
+    journal = crawler.journal
+    if journal and journal.entries and not (args.offline or args.dry_run):
+        print(f"{len(journal.entries)} failed download(s) recorded in {journal.path}; run again with --retry-failed to fetch only those.")
+        if any(e["error"] == "auth" for e in journal.entries.values()):
+            print("Some were refused with 401/403: the login session has probably expired, so log in again first.")
+        print()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# Local scrape daemon: a small HTTP/JSON API in front of ExtractPapers.Crawler, so several people can ask for
+# the same courses without each running their own login and crawl. Started with `ExtractPapers.py --serve`
+# (or `main.py --serve`, which logs in first).
+#
+#   POST /jobs               {"course_ids": ["MATH08058"], "fresh": false} -> 202 {"jobs": [...]}
+#   GET  /jobs               every job, newest first
+#   GET  /jobs/{id}          one job, with its papers
+#   GET  /jobs/{id}/events   newline-delimited JSON: status changes, progress and papers, until the job ends
+#   POST /session            {"cookie_header": "..."} swaps in a new Shibboleth cookie
+#   GET  /health, /metrics   queue state; the run metrics in Prometheus text format
+import json, time, queue, itertools, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import ExtractPapers
+
+DEFAULT_PORT = 8765
+FRESH_FOR_SECONDS = 300
+PROGRESS_INTERVAL_SECONDS = 0.5
+EVENT_WAIT_SECONDS = 15
+
+class ScrapeJob:
+    # one course crawl and everyone waiting on it. events is an append-only log that /events streams from;
+    # stage progress is folded into it at most every PROGRESS_INTERVAL_SECONDS.
+    def __init__(self, job_id, course_id):
+        self.id = job_id
+        self.course_id = course_id
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = self.finished_at = None
+        self.requests = 1
+        self.error = None
+        self.download_dir = None
+        self.stats = {}
+        self.stages = {}
+        self.papers = []
+        self.events = []
+        self.last_progress = 0.0
+        self.cond = threading.Condition()
+        self.emit({"event": "status", "status": self.status})
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def emit(self, event):
+        with self.cond:
+            self.events.append({"t": round(time.time(), 3), **event})
+            self.cond.notify_all()
+
+    def set_status(self, status, error=None):
+        # under one lock, so a reader that sees the job finished also sees its last events
+        with self.cond:
+            self.status = status
+            self.error = error
+            if status == "running":
+                self.started_at = time.time()
+            elif self.finished:
+                self.finished_at = time.time()
+                self.emit({"event": "progress", "stages": dict(self.stages)})
+            self.emit({"event": "status", "status": status, **({"error": error} if error else {})})
+
+    def progress(self, stage, done, total):
+        # called from the crawler's worker threads
+        now = time.monotonic()
+        with self.cond:
+            self.stages[stage] = {"done": done, "total": total}
+            if now - self.last_progress < PROGRESS_INTERVAL_SECONDS:
+                return
+            self.last_progress = now
+            stages = dict(self.stages)
+        self.emit({"event": "progress", "stages": stages})
+
+    def add_paper(self, paper):
+        record = paper._asdict()
+        with self.cond:
+            self.papers.append(record)
+        self.emit({"event": "paper", **record})
+
+    def events_since(self, index, timeout=EVENT_WAIT_SECONDS):
+        # (new events, finished); waits up to timeout for something new
+        with self.cond:
+            if index >= len(self.events) and not self.finished:
+                self.cond.wait(timeout)
+            return self.events[index:], self.finished
+
+    def summary(self, papers=False):
+        with self.cond:
+            counts = {}
+            for p in self.papers:
+                counts[p["status"]] = counts.get(p["status"], 0) + 1
+            out = {"id": self.id, "course_id": self.course_id, "status": self.status, "error": self.error, "requests": self.requests,
+                   "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+                   "download_dir": self.download_dir, "papers_by_status": counts, "stages": dict(self.stages), "stats": dict(self.stats)}
+            if papers:
+                out["papers"] = list(self.papers)
+        return out
+
+class ScrapeService:
+    # job queue with single-flight per course: a request for a course that is queued or running joins that
+    # job, and one that finished less than fresh_for seconds ago is answered from it. Jobs run one at a time
+    # (the crawler's base URL, pool and metrics are module-wide) in stable --sync folders, sharing one
+    # session, one MetadataCache and the keep-alive download pool.
+    def __init__(self, cookie_header, base_dir=None, base_url=None, fresh_for=FRESH_FOR_SECONDS, cache=True,
+                 cache_path=ExtractPapers.CACHE_PATH, cache_ttl=ExtractPapers.CACHE_TTL_SECONDS, crawler_options=None):
+        self.cookie_header = cookie_header
+        self.base_dir = base_dir
+        self.base_url = base_url
+        self.fresh_for = fresh_for
+        self.crawler_options = crawler_options or {}
+        self.session = ExtractPapers.make_session(cookie_header)
+        self.cache = ExtractPapers.MetadataCache(cache_path, ttl=cache_ttl) if cache else None
+        self.jobs = {}
+        self.active = {}
+        self.recent = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.q = queue.Queue()
+        self.stats = {"requests": 0, "coalesced": 0, "crawls": 0}
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, course_id, fresh=False):
+        # returns (job, coalesced)
+        course_id = course_id.strip().upper()
+        with self.lock:
+            self.stats["requests"] += 1
+            job = self.active.get(course_id)
+            if job is None and not fresh:
+                recent = self.recent.get(course_id)
+                if recent and time.time() - recent.finished_at < self.fresh_for:
+                    job = recent
+            if job is not None:
+                job.requests += 1
+                self.stats["coalesced"] += 1
+                return job, True
+            job = ScrapeJob(str(next(self.ids)), course_id)
+            self.jobs[job.id] = job
+            self.active[course_id] = job
+        self.q.put(job)
+        return job, False
+
+    def set_cookie(self, cookie_header):
+        with self.lock:
+            self.cookie_header = cookie_header
+            self.session.headers["Cookie"] = cookie_header
+
+    def _run(self):
+        while (job := self.q.get()) is not ExtractPapers._STOP:
+            self._crawl(job)
+
+    def _crawl(self, job):
+        # never raises: any failure ends this job and the worker moves on to the next one
+        error = crawler = None
+        try:
+            job.set_status("running")
+            with self.lock:
+                self.stats["crawls"] += 1
+                cookie_header = self.cookie_header
+            crawler = ExtractPapers.Crawler(cookie_header, [job.course_id], base_dir=self.base_dir, base_url=self.base_url, sync=True,
+                                            session=self.session, metadata_cache=self.cache, keep_connections=True,
+                                            on_progress=job.progress, **self.crawler_options)
+            for paper in crawler.papers():
+                job.add_paper(paper)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            for run in (crawler.runs if crawler else ()):
+                job.download_dir = str(run.download_dir)
+                job.stats = dict(run.stats)
+            # finished (with finished_at set) before it can be handed out from recent
+            job.set_status("failed" if error else "done", error)
+            with self.lock:
+                self.active.pop(job.course_id, None)
+                if error is None:
+                    self.recent[job.course_id] = job
+
+    def health(self):
+        with self.lock:
+            return {"status": "ok", **self.stats, "queued": sum(1 for j in self.active.values() if j.status == "queued"),
+                    "running": [j.id for j in self.active.values() if j.status == "running"],
+                    "metadata_cache": dict(self.cache.stats) if self.cache else None}
+
+    def list_jobs(self):
+        with self.lock:
+            jobs = sorted(self.jobs.values(), key=lambda j: j.created_at, reverse=True)
+        return [j.summary() for j in jobs]
+
+    def close(self):
+        self.q.put(ExtractPapers._STOP)
+        self.worker.join()
+        ExtractPapers.download_pool.close()
+        if self.cache:
+            self.cache.close()
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "exam-scraper-service/1.0"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return None
+            return body if isinstance(body, dict) else None
+
+        def do_GET(self):
+            parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+            if parts == ["health"]:
+                return self.send_json(200, service.health())
+            if parts == ["metrics"]:
+                data = ExtractPapers.run_metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                return self.wfile.write(data)
+            if parts == ["jobs"]:
+                return self.send_json(200, {"jobs": service.list_jobs()})
+            job = service.jobs.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+            if job is None:
+                return self.send_json(404, {"error": "not found"})
+            if len(parts) == 2:
+                return self.send_json(200, job.summary(papers=True))
+            if parts[2] == "events":
+                return self.stream_events(job)
+            self.send_json(404, {"error": "not found"})
+
+        def stream_events(self, job):
+            # no Content-Length: the stream ends when the job does and the connection closes
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            index = 0
+            try:
+                while True:
+                    events, finished = job.events_since(index)
+                    index += len(events)
+                    for event in events:
+                        self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                    if finished:
+                        return
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+        def do_POST(self):
+            body = self.read_json()
+            if body is None:
+                return self.send_json(400, {"error": "expected a JSON object"})
+            if self.path == "/jobs":
+                course_ids = body.get("course_ids") or ([body["course_id"]] if body.get("course_id") else [])
+                course_ids = ExtractPapers.dedupe(c.strip().upper() for c in course_ids if isinstance(c, str) and c.strip())
+                if not course_ids:
+                    return self.send_json(400, {"error": "course_ids is required"})
+                jobs = []
+                for course_id in course_ids:
+                    job, coalesced = service.submit(course_id, fresh=bool(body.get("fresh")))
+                    jobs.append({**job.summary(), "coalesced": coalesced, "events": f"/jobs/{job.id}/events"})
+                return self.send_json(202, {"jobs": jobs})
+            if self.path == "/session":
+                if not isinstance(body.get("cookie_header"), str) or not body["cookie_header"]:
+                    return self.send_json(400, {"error": "cookie_header is required"})
+                service.set_cookie(body["cookie_header"])
+                return self.send_json(200, {"status": "ok"})
+            self.send_json(404, {"error": "not found"})
+
+    return Handler
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    # event streams hold their connection open, and a burst of clients should not overflow the listen backlog
+    daemon_threads = True
+    request_queue_size = 128
+
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT):
+    return ServiceHTTPServer((host, port), make_handler(service))
+
+def serve(cookie_header, args):
+    # runs until interrupted; args are ExtractPapers' parsed command-line arguments
+    options = {"embed": not args.no_embed, "page_size": args.page_size, "min_downloads": args.min_downloads,
+               "max_downloads": args.max_downloads, "deduplicate": not args.no_dedupe}
+    service = ScrapeService(cookie_header, base_url=args.base_url, fresh_for=args.fresh_for, cache=not args.no_cache,
+                            cache_ttl=args.cache_ttl, crawler_options=options)
+    server = make_server(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Scrape service listening on http://{host}:{port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping.")
+    finally:
+        server.server_close()
+        service.close()
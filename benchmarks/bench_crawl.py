@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# End-to-end crawl benchmark against benchmarks/mock_dspace.py, so ExtractPapers performance can be
+# measured without touching the live service. The mock runs in a child process so the peak RSS reported
+# here is the crawler's own.
+#
+#   python benchmarks/bench_crawl.py --courses 2 --items 200 --latency 0.02 --bandwidth 2000000 --error-rate 0.01
+import os, sys, json, time, pathlib, argparse, tempfile, resource, subprocess, contextlib
+
+ROOT = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent))
+os.environ.setdefault("COOKIE_HEADER", "shibsession_bench=bench")
+import ExtractPapers
+import mock_dspace
+
+@contextlib.contextmanager
+def mock_server(mock_args):
+    proc = subprocess.Popen([sys.executable, str(ROOT / "mock_dspace.py"), "--port", "0", *mock_args],
+                            stdout=subprocess.PIPE, text=True)
+    try:
+        base_url = proc.stdout.readline().strip()
+        if not base_url:
+            raise RuntimeError("mock_dspace.py did not start.")
+        yield base_url
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def run_crawl(base_url, args):
+    ExtractPapers.BASE_URL = base_url
+    session = ExtractPapers.make_session()
+    limiter = ExtractPapers.RateLimiter(args.rps, args.inflight)
+    progress = ExtractPapers.StageProgress(quiet=True)
+    concurrency = ExtractPapers.AdaptiveConcurrency(args.min_downloads, args.max_downloads)
+    content = None if args.no_dedupe else ExtractPapers.ContentStore()
+    with tempfile.TemporaryDirectory() as out_dir:
+        runs = [ExtractPapers.CourseRun(f"BENCH{i:05d}", out_dir) for i in range(args.courses)]
+        start = time.perf_counter()
+        ExtractPapers.run_pipeline(session, limiter, runs, page_size=args.page_size, embed=not args.client_no_embed, progress=progress, concurrency=concurrency, content=content)
+        elapsed = time.perf_counter() - start
+    return runs, progress, concurrency, content, elapsed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--courses", type=int, default=1)
+    ap.add_argument("--rps", type=float, default=0, help="crawler rate limit (0 = unlimited)")
+    ap.add_argument("--inflight", type=int, default=ExtractPapers.MAX_INFLIGHT_REQUESTS)
+    ap.add_argument("--page-size", type=int, default=ExtractPapers.SEARCH_PAGE_SIZE)
+    ap.add_argument("--min-downloads", type=int, default=ExtractPapers.MIN_DOWNLOAD_WORKERS)
+    ap.add_argument("--max-downloads", type=int, default=ExtractPapers.MAX_DOWNLOAD_WORKERS)
+    ap.add_argument("--no-dedupe", action="store_true", help="crawl without the content store")
+    ap.add_argument("--client-no-embed", action="store_true", help="crawl without embed requests")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    mock_dspace.add_config_args(ap)
+    args = ap.parse_args()
+
+    with mock_server(mock_dspace.config_argv(args)) as base_url:
+        runs, progress, concurrency, content, elapsed = run_crawl(base_url, args)
+
+    stats = {k: sum(r.stats[k] for r in runs) for k in runs[0].stats}
+    pool = ExtractPapers.download_pool.stats
+    dc = concurrency.report()
+    requests_made = stats["requests"] + stats["planned"] + pool["redirects_followed"]
+    report = {
+        "wall_time_s": round(elapsed, 3),
+        "stage_wall_time_s": {s: round(progress.wall_time(s), 3) for s in progress.stages},
+        "metadata_requests": stats["requests"],
+        "metadata_requests_saved": stats["requests_saved"],
+        "failed_metadata_requests": stats["failed_requests"],
+        "papers_planned": stats["planned"],
+        "papers_downloaded": stats["downloaded"],
+        "bytes_downloaded": stats["bytes"],
+        "papers_deduplicated": stats["deduplicated"],
+        "requests_per_s": round(requests_made / elapsed, 1) if elapsed else None,
+        "mb_per_s": round(stats["bytes"] / 1e6 / elapsed, 2) if elapsed else None,
+        "download_concurrency": {k: dc[k] for k in ("final", "peak", "increases", "decreases", "throttled", "backoff_s")},
+        "concurrency_history": " ".join(f"{h['t_s']}s:{h['limit']}" for h in dc["history"]),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        if isinstance(value, dict):
+            value = "  ".join(f"{k}={v}" for k, v in value.items())
+        print(f"{key:<26} {value}")
+
+if __name__ == "__main__":
+    main()
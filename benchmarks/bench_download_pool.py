@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Counts connections (one TLS handshake each against the real https host) and redirects for a
+# batch of bitstream downloads, with and without the keep-alive pool in ExtractPapers.
+#
+#   python benchmarks/bench_download_pool.py [--files 50] [--size 200000] [--workers 5]
+import os, sys, time, pathlib, argparse, tempfile, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+os.environ.setdefault("COOKIE_HEADER", "shibsession_bench=bench")
+import ExtractPapers
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.redirects = 0
+
+    def add(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+def make_server(counters, handler_body):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            counters.add("connections")
+
+        def do_GET(self):
+            handler_body(self)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_servers(payload):
+    # "legacy" plays the http:// origin that redirects every path to the canonical origin
+    counters = Counters()
+
+    def serve_content(h):
+        h.send_response(200)
+        h.send_header("Content-Type", "application/pdf")
+        h.send_header("Content-Length", str(len(payload)))
+        h.end_headers()
+        h.wfile.write(payload)
+
+    canonical = make_server(counters, serve_content)
+    target = f"http://127.0.0.1:{canonical.server_port}"
+
+    def serve_redirect(h):
+        counters.add("redirects")
+        h.send_response(301)
+        h.send_header("Location", target + h.path)
+        h.send_header("Content-Length", "0")
+        h.end_headers()
+
+    legacy = make_server(counters, serve_redirect)
+    return counters, (legacy, canonical)
+
+def run(label, pool, files, size, workers):
+    counters, servers = start_servers(b"%PDF" + b"\0" * (size - 4))
+    legacy_port = servers[0].server_port
+    urls = [f"http://127.0.0.1:{legacy_port}/server/api/core/bitstreams/{i:08x}/content" for i in range(files)]
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(lambda iu: ExtractPapers.download_with_cookie_only(iu[1], os.path.join(out_dir, f"{iu[0]}.pdf"), ExtractPapers.COOKIE_HEADER, pool=pool), enumerate(urls)))
+        elapsed = time.perf_counter() - start
+    pool.close()
+    for s in servers:
+        s.shutdown()
+    print(f"{label:<8} files={files:<5} connections={counters.connections:<5} redirects={counters.redirects:<5} "
+          f"reused={pool.stats['connections_reused']:<5} redirects_skipped={pool.stats['redirects_skipped']:<5} time={elapsed:.2f}s")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=50)
+    ap.add_argument("--size", type=int, default=200_000)
+    ap.add_argument("--workers", type=int, default=ExtractPapers.INITIAL_DOWNLOAD_WORKERS)
+    args = ap.parse_args()
+    run("before", ExtractPapers.ConnectionPool(max_per_host=0, cache_redirects=False), args.files, args.size, args.workers)
+    run("after", ExtractPapers.ConnectionPool(max_per_host=args.workers), args.files, args.size, args.workers)
+
+if __name__ == "__main__":
+    main()
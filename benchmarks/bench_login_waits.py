@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Login-step latency: how long after an SSO screen appears the login flow in main.py notices it, with the
+# old page_source polling and with the in-page MutationObserver waits. Screens are the local HTML
+# fixtures in benchmarks/fixtures/sso, revealed after a delay by shell.html; needs Firefox and geckodriver.
+#
+#   python benchmarks/bench_login_waits.py [--runs 5] [--delay 300] [--pad 300] [--show]
+import sys, time, pathlib, argparse, threading, statistics, functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent))
+import main as login
+
+FIXTURES = ROOT / "fixtures" / "sso"
+
+# (screen, what the login flow waits for, phrases)
+CASES = [
+    ("login_error", "present", ["lightboxTemplateContainer", "Incorrect user ID or password"]),
+    ("lightbox", "present", ["lightboxTemplateContainer", "Incorrect user ID or password"]),
+    ("trouble_verifying", "present", ["trouble verifying your account", "Open your Authenticator", "Enter the code displayed"]),
+    ("trouble_verifying", "absent", ["lightbox-cover disable-lightbox"]),
+    ("authenticator", "present", ["Open your Authenticator", "Enter the code displayed"]),
+    ("otp", "present", ["Open your Authenticator", "Enter the code displayed"]),
+]
+
+def legacy_contains_any(driver, phrases, timeout=login.WAIT_SECONDS, poll_interval=0.5):
+    # the page_source polling main.py used before
+    end = time.time() + timeout
+    lowers = [p.lower() for p in phrases]
+    while time.time() < end:
+        src = (driver.page_source or "").lower()
+        for i, p in enumerate(lowers):
+            if p in src:
+                return phrases[i]
+        time.sleep(poll_interval)
+    return None
+
+def legacy_lacks(driver, phrase, timeout=login.WAIT_SECONDS, poll_interval=0.5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if phrase.lower() not in (driver.page_source or "").lower():
+            return True
+        time.sleep(poll_interval)
+    return False
+
+WAITS = {
+    "polling": {"present": legacy_contains_any, "absent": lambda d, p: legacy_lacks(d, p[0])},
+    "observer": {"present": login.wait_until_source_contains_any, "absent": lambda d, p: login.wait_until_source_lacks(d, p[0])},
+}
+
+def serve_fixtures():
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(FIXTURES))
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(driver, base_url, screen, mode, phrases, wait, args):
+    # ms from the screen change to the wait returning
+    clear = args.delay if mode == "absent" else 0
+    driver.get(f"{base_url}/shell.html?screen={screen}&delay={args.delay}&clear={clear}&pad={args.pad}")
+    if mode == "absent":
+        login.wait_until_source_contains_any(driver, phrases, timeout=10)
+    if not wait(driver, phrases):
+        return None
+    return driver.execute_script("return performance.now() - window.__changedAt")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--delay", type=int, default=300, help="ms before each screen appears")
+    ap.add_argument("--pad", type=int, default=300, help="KB of inline script text added to every page")
+    ap.add_argument("--show", action="store_true", help="run Firefox with a visible window")
+    args = ap.parse_args()
+    login.HEADLESS = not args.show
+    server = serve_fixtures()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    driver = login.make_driver()
+    try:
+        print(f"{'screen':<20} {'wait':<8} {'polling ms':>12} {'observer ms':>12}")
+        for screen, mode, phrases in CASES:
+            row = {}
+            for name, waits in WAITS.items():
+                samples = [measure(driver, base_url, screen, mode, phrases, waits[mode], args) for _ in range(args.runs)]
+                ok = [s for s in samples if s is not None]
+                row[name] = f"{statistics.median(ok):.0f}" if len(ok) == len(samples) else "timeout"
+            print(f"{screen:<20} {mode:<8} {row['polling']:>12} {row['observer']:>12}")
+    finally:
+        driver.quit()
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Micro-benchmark of the Step 3 bitstream-listing parser: the old regex-and-zip path against the
+# structured single-pass parse_bitstreams, over the listings in benchmarks/fixtures plus a large
+# listing built from them.
+#
+#   python benchmarks/bench_parse_bitstreams.py [--repeat 2000] [--large 200]
+import os, re, sys, json, copy, time, uuid, pathlib, argparse, itertools
+
+ROOT = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent))
+os.environ.setdefault("COOKIE_HEADER", "shibsession_bench=bench")
+import ExtractPapers
+
+legacy_bit_uuid_re = re.compile(r'https://exampapers\.ed\.ac\.uk/server/api/core/bitstreams/([0-9a-f-]+)/bundle')
+legacy_name_re = re.compile(r'"name"\s*:\s*"([^"]+)"')
+
+def legacy_parse(text):
+    # the regex/zip pairing plus the separate json.loads for sizes and checksums, as Step 3 used to do it
+    if "ORIGINAL" not in text:
+        return None
+    uuid3s = ExtractPapers.dedupe(legacy_bit_uuid_re.findall(text))
+    names = legacy_name_re.findall(text)
+    pairs = []
+    if uuid3s and names:
+        if len(uuid3s) == len(names):
+            pairs = list(zip(uuid3s, names))
+        else:
+            try:
+                data = json.loads(text)
+                bs_list = (data.get("_embedded", {}) or data.get("embedded", {})).get("bitstreams") or []
+                pairs = [(bs.get("uuid"), bs.get("name")) for bs in bs_list if bs.get("uuid") and bs.get("name")]
+            except Exception:
+                pairs = list(itertools.zip_longest(uuid3s, names, fillvalue="unknown"))
+    elif uuid3s:
+        pairs = [(u3, f"bitstream_{u3}.pdf") for u3 in uuid3s]
+    details = {}
+    if pairs:
+        for bs in (json.loads(text).get("_embedded") or {}).get("bitstreams") or []:
+            details[bs["uuid"]] = (bs.get("sizeBytes"), (bs.get("checkSum") or {}).get("value"))
+    return [(u3, nm) + details.get(u3, (None, None)) for u3, nm in ExtractPapers.dedupe(pairs)]
+
+def structured_parse(text):
+    records = ExtractPapers.parse_bitstreams(text)
+    return None if records is None else [(r.uuid, r.name, r.size_bytes, r.checksum) for r in records]
+
+def load_fixtures(large):
+    fixtures = {p.name: p.read_text(encoding="utf-8") for p in sorted((ROOT / "fixtures").glob("*.json"))}
+    base = json.loads(fixtures["bitstreams_original_multi.json"])
+    template = base["_embedded"]["bitstreams"]
+    many = []
+    for i in range(large):
+        bs = copy.deepcopy(template[i % len(template)])
+        old, new = bs["uuid"], str(uuid.UUID(int=i + 1))
+        bs = json.loads(json.dumps(bs).replace(old, new))
+        bs["name"] = f"{i:04d} {bs['name']}"
+        many.append(bs)
+    base["_embedded"]["bitstreams"] = many
+    base["page"]["totalElements"] = large
+    fixtures[f"synthetic_original_{large}.json"] = json.dumps(base, indent=2)
+    return fixtures
+
+def timed(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=2000)
+    ap.add_argument("--large", type=int, default=200, help="bitstreams in the synthetic large listing")
+    args = ap.parse_args()
+    print(f"JSON backend: {ExtractPapers.json_loads.__module__}")
+    print(f"{'fixture':<38} {'bytes':>8} {'regex us':>10} {'struct us':>10} {'speedup':>8}  agree")
+    for name, text in load_fixtures(args.large).items():
+        repeat = max(1, args.repeat * 1000 // max(len(text), 1000))
+        old_us = timed(legacy_parse, text, repeat)
+        new_us = timed(structured_parse, text, repeat)
+        agree = legacy_parse(text) == structured_parse(text)
+        print(f"{name:<38} {len(text):>8} {old_us:>10.1f} {new_us:>10.1f} {old_us / new_us:>7.2f}x  {'yes' if agree else 'NO'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Fires concurrent scrape requests at ScrapeService (in-process, against an in-process mock_dspace) and
+# reports how many crawls actually ran, how many requests were coalesced onto them and what reached the
+# mock, so single-flight and the shared cache can be checked without the live service.
+#
+#   python benchmarks/bench_service.py --clients 20 --courses 3 --items 50 --latency 0.01
+import os, sys, json, time, pathlib, argparse, tempfile, threading, urllib.request
+
+ROOT = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent))
+os.environ.setdefault("COOKIE_HEADER", "shibsession_bench=bench")
+import ExtractPapers
+import ScrapeService
+import mock_dspace
+
+def post_json(url, body):
+    req = urllib.request.Request(url, json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as r:
+        return json.loads(r.read())
+
+def wait_for_job(service_url, job_id):
+    # follows the event stream to the end; returns (events seen, final status)
+    events, status = 0, None
+    with urllib.request.urlopen(f"{service_url}/jobs/{job_id}/events") as r:
+        for line in r:
+            event = json.loads(line)
+            events += 1
+            if event["event"] == "status":
+                status = event["status"]
+    return events, status
+
+def client(service_url, course_id, results, i):
+    start = time.perf_counter()
+    job = post_json(f"{service_url}/jobs", {"course_ids": [course_id]})["jobs"][0]
+    events, status = wait_for_job(service_url, job["id"])
+    results[i] = {"job": job["id"], "coalesced": job["coalesced"], "status": status, "events": events, "latency_s": time.perf_counter() - start}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=20, help="concurrent scrape requests")
+    ap.add_argument("--courses", type=int, default=3, help="distinct courses the clients ask for")
+    ap.add_argument("--stagger", type=float, default=0.0, help="seconds between client starts")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    mock_dspace.add_config_args(ap)
+    args = ap.parse_args()
+
+    mock = mock_dspace.MockDSpace(mock_dspace.config_from_args(args)).start()
+    with tempfile.TemporaryDirectory() as out_dir:
+        service = ScrapeService.ScrapeService(ExtractPapers.COOKIE_HEADER, base_dir=out_dir, base_url=mock.base_url,
+                                              cache_path=os.path.join(out_dir, "cache.sqlite3"),
+                                              crawler_options={"journal": os.path.join(out_dir, "failed.json")})
+        server = ScrapeService.make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        service_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        results = [None] * args.clients
+        start = time.perf_counter()
+        threads = []
+        for i in range(args.clients):
+            t = threading.Thread(target=client, args=(service_url, f"BENCH{i % args.courses:05d}", results, i))
+            t.start()
+            threads.append(t)
+            time.sleep(args.stagger)
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        health = service.health()
+        server.shutdown()
+        server.server_close()
+        service.close()
+    mock.stop()
+
+    latencies = sorted(r["latency_s"] for r in results)
+    report = {
+        "wall_time_s": round(elapsed, 3),
+        "client_requests": health["requests"],
+        "crawls": health["crawls"],
+        "coalesced": health["coalesced"],
+        "jobs_done": sum(1 for r in results if r["status"] == "done"),
+        "client_latency_s": {"mean": round(sum(latencies) / len(latencies), 3), "max": round(latencies[-1], 3)},
+        "mock_requests": {k: mock.stats[k] for k in ("requests", "search", "items", "bundles", "content")},
+        "metadata_cache": health["metadata_cache"],
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        if isinstance(value, dict):
+            value = "  ".join(f"{k}={v}" for k, v in value.items())
+        print(f"{key:<20} {value}")
+
+if __name__ == "__main__":
+    main()
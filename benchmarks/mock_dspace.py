@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# Local stand-in for the exampapers DSpace REST API, for benchmarks and offline runs of the crawler.
+# Serves /discover/search/objects, /core/items/*/bundles, /core/bundles/*/bitstreams and
+# /core/bitstreams/*/content with deterministic synthetic courses, plus knobs for latency, bandwidth,
+# 429/5xx injection, a cap on concurrent downloads and redirects. Every course ID gets --items items; each item has an ORIGINAL bundle
+# with --pdfs PDFs and a THUMBNAIL bundle.
+#
+#   python benchmarks/mock_dspace.py --port 8080 --items 200 --latency 0.02 --error-rate 0.02
+#   EXAMPAPERS_BASE_URL=http://127.0.0.1:8080 COOKIE_HEADER=x=y python ExtractPapers.py MATH08058
+import sys, json, time, uuid, random, hashlib, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+API = "/server/api"
+NAMESPACE = uuid.UUID("3b1c6f0e-8f1e-4d56-9b0e-6b7c2f0d5a11")
+
+def make_uuid(*parts):
+    return str(uuid.uuid5(NAMESPACE, ":".join(str(p) for p in parts)))
+
+def page_json(count, number=0, size=None):
+    # a full DSpace page object; an empty listing is still one (empty) page
+    size = count if size is None else size
+    return {"number": number, "size": size, "totalElements": count, "totalPages": max(1, -(-count // max(1, size)))}
+
+class MockConfig:
+    def __init__(self, items=50, pdfs=1, pdf_size=200_000, latency=0.0, bandwidth=0, error_rate=0.0,
+                 redirect_content=False, embed=True, seed=1, cookie=None, shared_items=0, max_concurrent=0, retry_after=1.0,
+                 duplicate_rate=0.0):
+        self.items = items
+        self.pdfs = pdfs
+        self.pdf_size = pdf_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.redirect_content = redirect_content
+        self.embed = embed
+        self.seed = seed
+        self.cookie = cookie
+        self.shared_items = shared_items
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.duplicate_rate = duplicate_rate
+
+class MockDSpace:
+    # builds the synthetic repository lazily from search queries and serves it on a ThreadingHTTPServer
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or MockConfig()
+        self.items = {}
+        self.bundles = {}
+        self.bitstreams = {}
+        self.originals = []
+        self.lock = threading.Lock()
+        self.content_inflight = 0
+        self.random = random.Random(self.config.seed)
+        self.stats = {"requests": 0, "search": 0, "items": 0, "bundles": 0, "content": 0,
+                      "redirects": 0, "injected_errors": 0, "bytes_sent": 0, "ranges": 0, "conditional_hits": 0,
+                      "throttled": 0, "peak_content_inflight": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    # --- synthetic repository -------------------------------------------------------------------
+
+    def course_items(self, course_id):
+        cfg = self.config
+        uuids = [make_uuid("item", "shared", i) for i in range(min(cfg.shared_items, cfg.items))]
+        uuids += [make_uuid("item", course_id, i) for i in range(cfg.items - len(uuids))]
+        with self.lock:
+            for n, item_uuid in enumerate(uuids):
+                if item_uuid not in self.items:
+                    self._build_item(item_uuid, f"{course_id} {2000 + n % 25} paper {n}")
+        return uuids
+
+    def _build_item(self, item_uuid, title):
+        cfg = self.config
+        bundle_uuids = []
+        for bundle_name, count in (("ORIGINAL", cfg.pdfs), ("THUMBNAIL", cfg.pdfs)):
+            bundle_uuid = make_uuid("bundle", item_uuid, bundle_name)
+            bitstream_uuids = []
+            for k in range(count):
+                bs_uuid = make_uuid("bitstream", bundle_uuid, k)
+                content_id = bs_uuid
+                if bundle_name == "ORIGINAL":
+                    size = max(1, int(cfg.pdf_size * (0.5 + self.random.random())))
+                    name = f"{title}{'' if k == 0 else f' part {k + 1}'}.pdf"
+                    if self.originals and self.random.random() < cfg.duplicate_rate:
+                        # the same PDF uploaded again under another item
+                        original = self.bitstreams[self.random.choice(self.originals)]
+                        content_id, size = original["content_id"], original["size"]
+                    else:
+                        self.originals.append(bs_uuid)
+                else:
+                    size = 4096
+                    name = f"{title}.pdf.jpg"
+                self.bitstreams[bs_uuid] = {"uuid": bs_uuid, "name": name, "size": size, "bundle": bundle_uuid, "bundle_name": bundle_name,
+                                            "content_id": content_id, "md5": hashlib.md5(self.content(content_id, size)).hexdigest()}
+                bitstream_uuids.append(bs_uuid)
+            self.bundles[bundle_uuid] = {"uuid": bundle_uuid, "name": bundle_name, "item": item_uuid, "bitstreams": bitstream_uuids}
+            bundle_uuids.append(bundle_uuid)
+        self.items[item_uuid] = {"uuid": item_uuid, "name": title, "bundles": bundle_uuids}
+
+    @staticmethod
+    def content(content_id, size):
+        block = b"%PDF-1.4\n" + hashlib.sha256(content_id.encode()).digest() * 32
+        return (block * (size // len(block) + 1))[:size]
+
+    def bitstream_json(self, base, bs):
+        u = bs["uuid"]
+        return {"id": u, "uuid": u, "name": bs["name"], "bundleName": bs["bundle_name"], "sizeBytes": bs["size"],
+                "checkSum": {"checkSumAlgorithm": "MD5", "value": bs["md5"]}, "type": "bitstream",
+                "_links": {"content": {"href": f"{base}{API}/core/bitstreams/{u}/content"},
+                           "bundle": {"href": f"{base}{API}/core/bitstreams/{u}/bundle"},
+                           "self": {"href": f"{base}{API}/core/bitstreams/{u}"}}}
+
+    def bundle_json(self, base, bundle, embed_bitstreams):
+        u = bundle["uuid"]
+        data = {"uuid": u, "id": u, "name": bundle["name"], "type": "bundle",
+                "_links": {"bitstreams": {"href": f"{base}{API}/core/bundles/{u}/bitstreams"},
+                           "self": {"href": f"{base}{API}/core/bundles/{u}"}}}
+        if embed_bitstreams:
+            listing = [self.bitstream_json(base, self.bitstreams[b]) for b in bundle["bitstreams"]]
+            data["_embedded"] = {"bitstreams": {"_embedded": {"bitstreams": listing}, "page": page_json(len(listing))}}
+        return data
+
+    def item_json(self, base, item, embed_bundles):
+        u = item["uuid"]
+        data = {"uuid": u, "id": u, "name": item["name"], "type": "item",
+                "_links": {"bundles": {"href": f"{base}{API}/core/items/{u}/bundles"},
+                           "self": {"href": f"{base}{API}/core/items/{u}"}}}
+        if embed_bundles:
+            bundles = [self.bundle_json(base, self.bundles[b], True) for b in item["bundles"]]
+            data["_embedded"] = {"bundles": {"_embedded": {"bundles": bundles}, "page": page_json(len(bundles))}}
+        return data
+
+    # --- HTTP -----------------------------------------------------------------------------------
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                mock.count("requests")
+                cfg = mock.config
+                if cfg.latency:
+                    time.sleep(cfg.latency)
+                if cfg.cookie and cfg.cookie not in (self.headers.get("Cookie") or ""):
+                    return self.send_json({"message": "Authentication is required"}, 401)
+                if cfg.error_rate and mock.random.random() < cfg.error_rate:
+                    mock.count("injected_errors")
+                    status = mock.random.choice((429, 500, 503))
+                    return self.send_json({"message": "injected"}, status, {"Retry-After": "0"} if status != 500 else None)
+                parts = urlsplit(self.path)
+                query = parse_qs(parts.query)
+                segments = parts.path[len(API):].strip("/").split("/") if parts.path.startswith(API) else []
+                base = f"http://{self.headers.get('Host')}"
+                try:
+                    if segments[:3] == ["discover", "search", "objects"]:
+                        return self.search(base, query)
+                    if len(segments) == 4 and segments[:2] == ["core", "items"] and segments[3] == "bundles":
+                        return self.item_bundles(base, segments[2], query)
+                    if len(segments) == 4 and segments[:2] == ["core", "bundles"] and segments[3] == "bitstreams":
+                        return self.bundle_bitstreams(base, segments[2])
+                    if len(segments) == 4 and segments[:2] == ["core", "bitstreams"] and segments[3] == "content":
+                        return self.content(segments[2], query)
+                except KeyError:
+                    pass
+                self.send_json({"message": "Not found"}, 404)
+
+            def send_json(self, data, status=200, headers=None):
+                body = json.dumps(data).encode()
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    mock.count("conditional_hits")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/hal+json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 200:
+                    self.send_header("ETag", etag)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def search(self, base, query):
+                mock.count("search")
+                course_id = (query.get("query") or [""])[0]
+                page = int((query.get("page") or ["0"])[0])
+                size = max(1, int((query.get("size") or ["20"])[0]))
+                embed_bundles = mock.config.embed and "bundles/bitstreams" in (query.get("embed") or [])
+                uuids = mock.course_items(course_id) if course_id else []
+                objects = [{"_embedded": {"indexableObject": mock.item_json(base, mock.items[u], embed_bundles)}}
+                           for u in uuids[page * size:(page + 1) * size]]
+                self.send_json({"_embedded": {"searchResult": {
+                    "_embedded": {"objects": objects},
+                    "page": page_json(len(uuids), page, size)}}})
+
+            def item_bundles(self, base, item_uuid, query):
+                mock.count("items")
+                item = mock.items[item_uuid]
+                embed = mock.config.embed and "bitstreams" in (query.get("embed") or [])
+                bundles = [mock.bundle_json(base, mock.bundles[b], embed) for b in item["bundles"]]
+                self.send_json({"_embedded": {"bundles": bundles}, "page": page_json(len(bundles))})
+
+            def bundle_bitstreams(self, base, bundle_uuid):
+                mock.count("bundles")
+                bundle = mock.bundles[bundle_uuid]
+                listing = [mock.bitstream_json(base, mock.bitstreams[b]) for b in bundle["bitstreams"]]
+                self.send_json({"_embedded": {"bitstreams": listing}, "page": page_json(len(listing))})
+
+            def content(self, bs_uuid, query):
+                bs = mock.bitstreams[bs_uuid]
+                if mock.config.redirect_content and "direct" not in query:
+                    mock.count("redirects")
+                    self.send_response(302)
+                    self.send_header("Location", f"{API}/core/bitstreams/{bs_uuid}/content?direct=1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                with mock.lock:
+                    throttled = mock.config.max_concurrent and mock.content_inflight >= mock.config.max_concurrent
+                    if throttled:
+                        mock.stats["throttled"] += 1
+                    else:
+                        mock.content_inflight += 1
+                        mock.stats["peak_content_inflight"] = max(mock.stats["peak_content_inflight"], mock.content_inflight)
+                if throttled:
+                    return self.send_json({"message": "Too many concurrent downloads"}, 429, {"Retry-After": str(mock.config.retry_after)})
+                try:
+                    self.send_content(bs_uuid, bs)
+                finally:
+                    with mock.lock:
+                        mock.content_inflight -= 1
+
+            def send_content(self, bs_uuid, bs):
+                mock.count("content")
+                data = mock.content(bs["content_id"], bs["size"])
+                start = 0
+                rng = self.headers.get("Range") or ""
+                if rng.startswith("bytes=") and rng.endswith("-"):
+                    start = int(rng[6:-1])
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(data)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    mock.count("ranges")
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+                else:
+                    self.send_response(200)
+                body = data[start:]
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                self.write_throttled(body)
+
+            def write_throttled(self, body):
+                bandwidth = mock.config.bandwidth
+                chunk = 65536 if not bandwidth else max(1024, bandwidth // 20)
+                for i in range(0, len(body), chunk):
+                    part = body[i:i + chunk]
+                    self.wfile.write(part)
+                    mock.count("bytes_sent", len(part))
+                    if bandwidth:
+                        time.sleep(len(part) / bandwidth)
+
+        return Handler
+
+def add_config_args(ap):
+    ap.add_argument("--items", type=int, default=50, help="items per course")
+    ap.add_argument("--pdfs", type=int, default=1, help="PDFs per item")
+    ap.add_argument("--pdf-size", type=int, default=200_000, help="mean PDF size in bytes (varies 0.5x-1.5x)")
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    ap.add_argument("--bandwidth", type=int, default=0, help="bytes/sec per PDF response (0 = unthrottled)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429/500/503")
+    ap.add_argument("--redirect-content", action="store_true", help="302 every content URL to its real location first")
+    ap.add_argument("--no-embed", action="store_true", help="ignore embed parameters, like an older DSpace")
+    ap.add_argument("--max-concurrent", type=int, default=0, help="answer content requests beyond this many in flight with 429 (0 = no cap)")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with --max-concurrent 429s")
+    ap.add_argument("--duplicate-rate", type=float, default=0.0, help="fraction of PDFs that repeat an earlier PDF's bytes under a new bitstream")
+    ap.add_argument("--shared-items", type=int, default=0, help="items listed under every course")
+    ap.add_argument("--cookie", help="require this substring in the Cookie header")
+    ap.add_argument("--seed", type=int, default=1)
+
+def config_from_args(args):
+    return MockConfig(items=args.items, pdfs=args.pdfs, pdf_size=args.pdf_size, latency=args.latency,
+                      bandwidth=args.bandwidth, error_rate=args.error_rate, redirect_content=args.redirect_content,
+                      embed=not args.no_embed, seed=args.seed, cookie=args.cookie, shared_items=args.shared_items,
+                      max_concurrent=args.max_concurrent, retry_after=args.retry_after, duplicate_rate=args.duplicate_rate)
+
+def config_argv(args):
+    # command line for a mock_dspace.py child process with the same settings as args
+    argv = ["--items", str(args.items), "--pdfs", str(args.pdfs), "--pdf-size", str(args.pdf_size),
+            "--latency", str(args.latency), "--bandwidth", str(args.bandwidth), "--error-rate", str(args.error_rate),
+            "--shared-items", str(args.shared_items), "--seed", str(args.seed),
+            "--max-concurrent", str(args.max_concurrent), "--retry-after", str(args.retry_after),
+            "--duplicate-rate", str(args.duplicate_rate)]
+    if args.redirect_content:
+        argv.append("--redirect-content")
+    if args.no_embed:
+        argv.append("--no-embed")
+    if args.cookie:
+        argv += ["--cookie", args.cookie]
+    return argv
+
+def main():
+    ap = argparse.ArgumentParser(description="Mock exampapers DSpace REST API.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    add_config_args(ap)
+    args = ap.parse_args()
+    mock = MockDSpace(config_from_args(args), args.host, args.port).start()
+    print(mock.base_url, flush=True)
+    try:
+        mock.thread.join()
+    except KeyboardInterrupt:
+        mock.stop()
+    print(json.dumps(mock.stats), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,16 @@
-import os, sys, json, time, warnings, logging, subprocess
+import os, sys, json, time, base64, warnings, logging, argparse
 from threading import Thread, Event
 from pathlib import Path
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
-from selenium.webdriver.remote.remote_connection import LOGGER as SELENIUM_LOGGER
-from selenium.webdriver.firefox.options import Options as FFOptions
-from selenium.webdriver.firefox.service import Service as FFService
 
 WAIT_SECONDS = 30
 HEADLESS = True
 LOGIN_URL = "https://www.myed.ed.ac.uk/uPortal/Login?refUrl=%2Fmyed-progressive%2F"
 EXAMS_URL = "https://exampapers.ed.ac.uk/"
+SESSION_PATH = Path(__file__).resolve().parent / ".shib_session.json"
+SESSION_CHECK_URL = EXAMS_URL + "Shibboleth.sso/Session"
+SESSION_KEY_ENV = "EXAMPAPERS_SESSION_KEY"
+SESSION_MAX_AGE_SECONDS = 24 * 3600
+SESSION_KDF_ITERATIONS = 200_000
 
 def input_password_asterisk(prompt="Password: "):
     try:
@@ -70,7 +67,19 @@ def input_password_asterisk(prompt="Password: "):
             except Exception:
                 return input(prompt)
 
+def _import_selenium():
+    # selenium is only needed when there is no usable saved session, so it is imported on first use
+    global webdriver, By, WebDriverWait, EC, TimeoutException, NoSuchElementException, WebDriverException, FFOptions, FFService
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
+    from selenium.webdriver.firefox.options import Options as FFOptions
+    from selenium.webdriver.firefox.service import Service as FFService
+
 def make_driver():
+    _import_selenium()
     ff_opts = FFOptions()
     if HEADLESS:
         ff_opts.add_argument("-headless")
@@ -135,25 +144,66 @@ def get_text_if_present(driver, by, locator, timeout=WAIT_SECONDS):
     except Exception:
         return ""
 
+# Phrase checks run in the page against the serialised DOM (what page_source returns), so only a
+# boolean or the matched phrase crosses the WebDriver connection. The async variant re-checks from a
+# MutationObserver and answers as soon as the page changes instead of on a poll interval.
+_DOM_MATCH_JS = """
+const src = document.documentElement.outerHTML.toLowerCase();
+return arguments[0].find(p => src.includes(p.toLowerCase())) || null;
+"""
+
+_DOM_WAIT_JS = """
+const [phrases, present, timeoutMs, done] = arguments;
+const lowers = phrases.map(p => p.toLowerCase());
+const check = () => {
+    const src = document.documentElement.outerHTML.toLowerCase();
+    const i = lowers.findIndex(p => src.includes(p));
+    if (present) return i >= 0 ? phrases[i] : null;
+    return i < 0 ? "" : null;
+};
+const first = check();
+if (first !== null) return done(first);
+let pending = false, timer = null;
+const obs = new MutationObserver(() => {
+    if (pending) return;
+    pending = true;
+    setTimeout(() => {
+        pending = false;
+        const hit = check();
+        if (hit !== null) { obs.disconnect(); clearTimeout(timer); done(hit); }
+    }, 0);
+});
+obs.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+timer = setTimeout(() => { obs.disconnect(); done(null); }, timeoutMs);
+"""
+
 def page_contains(driver, phrase: str) -> bool:
     try:
-        return phrase.lower() in (driver.page_source or "").lower()
+        return bool(driver.execute_script(_DOM_MATCH_JS, [phrase]))
     except Exception:
         return False
 
-def wait_until_source_contains_any(driver, phrases, timeout=WAIT_SECONDS, poll_interval=0.5):
-    end = time.time() + timeout
-    lowers = [p.lower() for p in phrases]
-    while time.time() < end:
+def _wait_dom(driver, phrases, present, timeout):
+    # one observer per document; a navigation aborts the script, so wait again on the new page
+    end = time.monotonic() + timeout
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return None
         try:
-            src = (driver.page_source or "").lower()
-            for i, p in enumerate(lowers):
-                if p in src:
-                    return phrases[i]
-        except Exception:
-            pass
-        time.sleep(poll_interval)
-    return None
+            driver.set_script_timeout(remaining + 5)
+            hit = driver.execute_async_script(_DOM_WAIT_JS, list(phrases), present, int(remaining * 1000))
+            if hit is not None or time.monotonic() >= end:
+                return hit
+        except WebDriverException:
+            time.sleep(0.05)
+
+def wait_until_source_contains_any(driver, phrases, timeout=WAIT_SECONDS):
+    hit = _wait_dom(driver, phrases, True, timeout)
+    return next((p for p in phrases if hit and p.lower() == hit.lower()), None)
+
+def wait_until_source_lacks(driver, phrase, timeout=WAIT_SECONDS):
+    return _wait_dom(driver, [phrase], False, timeout) is not None
 
 def extract_name_from_welcome(raw: str) -> str | None:
     if not raw:
@@ -168,6 +218,86 @@ def extract_name_from_welcome(raw: str) -> str | None:
         name = parts[-1]
     return name.strip() or None
 
+def _session_fernet(passphrase, salt):
+    # Fernet key derived from the EXAMPAPERS_SESSION_KEY passphrase; needs the optional cryptography package
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=SESSION_KDF_ITERATIONS)
+    return Fernet(base64.urlsafe_b64encode(kdf.derive(passphrase.encode())))
+
+def save_session(cookie_header, expiry=None, path=SESSION_PATH):
+    # owner-only file, written atomically; encrypted when EXAMPAPERS_SESSION_KEY is set
+    record = {"saved_at": time.time(), "expiry": expiry}
+    passphrase = os.environ.get(SESSION_KEY_ENV)
+    if passphrase:
+        try:
+            salt = os.urandom(16)
+            token = _session_fernet(passphrase, salt).encrypt(cookie_header.encode())
+        except ImportError:
+            print(f"{SESSION_KEY_ENV} is set but the cryptography package is not installed; session not saved.")
+            return False
+        record.update(salt=base64.b64encode(salt).decode(), token=token.decode())
+    else:
+        record["cookie_header"] = cookie_header
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+    return True
+
+def load_session(path=SESSION_PATH, max_age=SESSION_MAX_AGE_SECONDS):
+    # the saved cookie header, or None if there is none, it has expired or it cannot be decrypted
+    try:
+        with open(path, encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    now = time.time()
+    if now - record.get("saved_at", 0) > max_age or (record.get("expiry") and record["expiry"] <= now):
+        return None
+    if "token" not in record:
+        return record.get("cookie_header")
+    passphrase = os.environ.get(SESSION_KEY_ENV)
+    if not passphrase:
+        return None
+    try:
+        return _session_fernet(passphrase, base64.b64decode(record["salt"])).decrypt(record["token"].encode()).decode()
+    except ImportError:
+        print("The saved session is encrypted but the cryptography package is not installed.")
+        return None
+    except Exception:
+        return None
+
+def session_is_valid(cookie_header, timeout=10):
+    # one request to the Shibboleth SP session handler, which lists the session only while it is live
+    import requests
+    try:
+        r = requests.get(SESSION_CHECK_URL, headers={"Cookie": cookie_header}, timeout=timeout, allow_redirects=False)
+    except requests.RequestException:
+        return False
+    return r.status_code == 200 and "session expiration" in r.text.lower()
+
+def run_extractor(cookie_header, argv):
+    # runs the crawler in this process; the cookie is passed in memory rather than through the environment.
+    # Returns False, after reporting why, if the crawl failed.
+    import ExtractPapers
+    try:
+        ExtractPapers.main(argv, cookie_header=cookie_header)
+    except Exception as e:
+        print(f"Paper extraction failed: {type(e).__name__}: {e}")
+        return False
+    return True
+
+def parse_login_args(argv):
+    # main.py's own flags; everything else is passed through to ExtractPapers.py
+    ap = argparse.ArgumentParser(add_help=False)
+    ap.add_argument("--fresh-login", action="store_true", help="ignore the saved session and log in again")
+    ap.add_argument("--no-session-cache", action="store_true", help="neither use nor save a login session")
+    return ap.parse_known_args(argv)
+
 def _boot_driver_and_open_login(holder: dict, ready_evt: Event):
     try:
         d = make_driver()
@@ -179,6 +309,15 @@ def _boot_driver_and_open_login(holder: dict, ready_evt: Event):
         ready_evt.set()
 
 def main():
+    args, extract_argv = parse_login_args(sys.argv[1:])
+    if not (args.fresh_login or args.no_session_cache):
+        cookie_header = load_session()
+        if cookie_header and session_is_valid(cookie_header):
+            print("Reusing saved login session.")
+            if not run_extractor(cookie_header, extract_argv):
+                sys.exit(1)
+            return
+
     ready = Event()
     holder = {}
     Thread(target=_boot_driver_and_open_login, args=(holder, ready), daemon=True).start()
@@ -205,8 +344,7 @@ def main():
         wait_until_source_contains_any(
             driver,
             phrases=["lightboxTemplateContainer", "Incorrect user ID or password"],
-            timeout=WAIT_SECONDS,
-            poll_interval=0.5
+            timeout=WAIT_SECONDS
         )
         
         if page_contains(driver, "Incorrect user ID or password"):
@@ -219,8 +357,7 @@ def main():
         wait_until_source_contains_any(
             driver,
             phrases=["trouble verifying your account", "Open your Authenticator", "Enter the code displayed"],
-            timeout=WAIT_SECONDS,
-            poll_interval=0.5
+            timeout=WAIT_SECONDS
         )
 
         if page_contains(driver, "trouble verifying your account"):
@@ -238,33 +375,23 @@ def main():
 
                 if has1:
                     # print("found 1")
-                    while True:
-                        if page_contains(driver, "lightbox-cover disable-lightbox"):
-                            # print("1: loading wait")
-                            time.sleep(0.5)
-                        else:
-                            break
+                    wait_until_source_lacks(driver, "lightbox-cover disable-lightbox")
                     # print("broke 1")
                     click_if_present(driver, By.XPATH, proof1)
 
                 if has2:
                     # print("found 2")
-                    while True:
-                        if page_contains(driver, "lightbox-cover disable-lightbox"):
-                            # print("2: loading wait")
-                            time.sleep(0.5)
-                        else:
-                            break
+                    wait_until_source_lacks(driver, "lightbox-cover disable-lightbox")
                     # print("broke 2")
                     click_if_present(driver, By.XPATH, proof2)
 
-                time.sleep(0.5)
+                # give the click a moment to bring up the lightbox before looking for proofs again
+                wait_until_source_contains_any(driver, ["lightbox-cover disable-lightbox"], timeout=0.5)
 
             wait_until_source_contains_any(
             driver,
             phrases=["Open your Authenticator", "Enter the code displayed"],
-            timeout=WAIT_SECONDS,
-            poll_interval=0.5
+            timeout=WAIT_SECONDS
             )
             
         if page_contains(driver, "Enter the code displayed"):
@@ -308,23 +435,27 @@ def main():
 
         try:
             cookies = driver.get_cookies()
-            shib = next((c for c in cookies if "shibsession" in (c.get("name") or "").lower()), None)
-            if shib and shib.get("name") and shib.get("value"):
-                print("Login Cookie Extracted!")
-                env = os.environ.copy()
-                env["COOKIE_HEADER"] = f"{shib['name']}={shib['value']}"
-                base_dir = Path(__file__).resolve().parent
-                subprocess.run([sys.executable, "ExtractPapers.py"], cwd=base_dir, env=env, check=True)
-            else:
-                print("Shibsession cookie not found.")
         except Exception as e:
-            print(f"Failed to pass cookie to ExtractPapers.py: {e}")
+            print(f"Failed to read the login cookies: {e}")
+            cookies = []
+        shib = next((c for c in cookies if "shibsession" in (c.get("name") or "").lower()), None)
+        if shib and shib.get("name") and shib.get("value"):
+            print("Login Cookie Extracted!")
+            cookie_header = f"{shib['name']}={shib['value']}"
+            if not args.no_session_cache:
+                save_session(cookie_header, shib.get("expiry"))
+            extracted = run_extractor(cookie_header, extract_argv)
+        else:
+            print("Shibsession cookie not found.")
+            extracted = False
 
     finally:
         try:
             driver.quit()
         except Exception:
             pass
+    if not extracted:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,49 @@
+# Regression tests for ExtractPapers' bitstream download against small local HTTP servers.
+import sys, pathlib, tempfile, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import ExtractPapers
+
+class PartialContentHandler(BaseHTTPRequestHandler):
+    # answers every GET with 206 and a Content-Range that never matches what was asked for
+    requests = 0
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        type(self).requests += 1
+        body = b"%PDF-1.4 partial"
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes 5-{4 + len(body)}/1000")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class DownloadRestartTest(unittest.TestCase):
+    def setUp(self):
+        PartialContentHandler.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PartialContentHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = ExtractPapers.ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_unrequested_partial_content_restarts_once_then_fails(self):
+        host, port = self.server.server_address[:2]
+        out_path = pathlib.Path(self.tmp.name) / "paper.pdf"
+        with self.assertRaises(ExtractPapers.DownloadHTTPError) as caught:
+            ExtractPapers.download_with_cookie_only(f"http://{host}:{port}/content", out_path, "c=1", pool=self.pool, expected_size=1000)
+        self.assertEqual(caught.exception.status, 206)
+        self.assertEqual(ExtractPapers.classify_download_error(caught.exception), "transient")
+        self.assertEqual(PartialContentHandler.requests, 2)
+
+if __name__ == "__main__":
+    unittest.main()
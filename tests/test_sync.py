@@ -0,0 +1,54 @@
+# Regression tests for --sync against benchmarks/mock_dspace.py; run with `python -m unittest discover tests`.
+import os, sys, hashlib, pathlib, tempfile, unittest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+import ExtractPapers
+import mock_dspace
+
+class SyncRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.mock = mock_dspace.MockDSpace(mock_dspace.MockConfig(items=3, pdfs=1, pdf_size=4000, shared_items=3)).start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.mock.stop()
+        self.tmp.cleanup()
+
+    def crawl(self, course_ids, deduplicate):
+        crawler = ExtractPapers.Crawler("shibsession_test=test", course_ids, base_dir=self.tmp.name, base_url=self.mock.base_url,
+                                        sync=True, cache=False, deduplicate=deduplicate, journal=None)
+        return crawler.run()
+
+    def change_upstream(self, bs_uuid):
+        # new bytes of the same size, as when a paper is replaced by a corrected scan
+        bs = self.mock.bitstreams[bs_uuid]
+        bs["content_id"] = f"{bs['content_id']}-v2"
+        bs["md5"] = hashlib.md5(self.mock.content(bs["content_id"], bs["size"])).hexdigest()
+        return bs
+
+    def check_refreshed(self, course_ids, deduplicate):
+        first = self.crawl(course_ids, deduplicate)
+        changed = self.change_upstream(first[0].uuid)
+        second = {(p.course_id, p.uuid): p for p in self.crawl(course_ids, deduplicate)}
+        for course_id in course_ids:
+            paper = second[(course_id, changed["uuid"])]
+            self.assertIn(paper.status, ("downloaded", "linked"))
+            with open(paper.path, "rb") as f:
+                self.assertEqual(hashlib.md5(f.read()).hexdigest(), changed["md5"])
+            self.assertEqual(os.path.getsize(paper.path), changed["size"])
+        unchanged = [p for p in second.values() if p.uuid != changed["uuid"]]
+        self.assertTrue(unchanged and all(p.status == "unchanged" for p in unchanged))
+
+    def test_same_size_change_is_downloaded_without_dedupe(self):
+        self.check_refreshed(["SYNC01"], deduplicate=False)
+
+    def test_same_size_change_is_downloaded_with_dedupe(self):
+        self.check_refreshed(["SYNC01"], deduplicate=True)
+
+    def test_same_size_change_reaches_every_cross_listed_course(self):
+        self.check_refreshed(["SYNC01", "SYNC02"], deduplicate=False)
+
+if __name__ == "__main__":
+    unittest.main()